@@ -126,7 +126,8 @@ function buildHeatGeoJSON(list, zoom) {
 let __HEAT_GEO_LOADING = (async () => {
     const base = import.meta.env.VITE_BACKEND_URL || window.location.origin;
     const url = base.replace(/\/$/, '') + '/heatmap';
-    const res = await fetch(url, {cache: 'no-store', mode: 'cors'});
+    // 'no-cache' revalidates with the server's ETag (304, no body) instead of always refetching
+    const res = await fetch(url, {cache: 'no-cache', mode: 'cors'});
     if (!res || !('ok' in res)) {
         throw new Error('No Response object from fetch');
     }
@@ -136,14 +136,27 @@ export default function Sidebar() {
         throw new Error('Chat API failed to process message. Status: ' + res.status);
       }
 
-      // 3. On success, fetch the full history to get the persisted messages
+      // 3. Stream the assistant reply into a temporary bubble as chunks arrive
+      const tempReply = { role: 'assistant', text: '', temp: true, id: Date.now() + 1 };
+      setChatMessages(prev => [...prev, tempReply]);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let reply = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        reply += decoder.decode(value, { stream: true });
+        setChatMessages(prev => prev.map(m => (m.id === tempReply.id ? { ...m, text: reply } : m)));
+      }
+
+      // 4. Stream finished (reply is persisted server-side): fetch the full history
       await fetchChatHistory();
 
     } catch (e) {
       console.error('Error sending message:', e);
-      // 4. On failure, replace the temporary user message with an assistant error
+      // 5. On failure, replace the temporary user message (and any partial reply) with an assistant error
       setChatMessages(prev => {
-          const newMessages = prev.filter(m => m.id !== tempMessage.id);
+          const newMessages = prev.filter(m => !m.temp);
           return [...newMessages, { role: 'assistant', text: `Sorry, I ran into an error: ${e.message}`, id: Date.now() }];
       });
     } finally {
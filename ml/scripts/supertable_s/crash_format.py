@@ -1,28 +1,29 @@
 import pandas as pd
 
-df = pd.read_csv("../../data/data_raw/CAR_CRASH.csv")
-# cols = ["NUMBER OF PERSONS INJURED", "NUMBER OF PERSONS KILLED", "NUMBER OF PEDESTRIANS INJURED", "NUMBER OF PEDESTRIANS KILLED", "NUMBER OF CYCLIST INJURED", "NUMBER OF CYCLIST KILLED", "NUMBER OF MOTORIST INJURED", "NUMBER OF MOTORIST KILLED"]
-
-dt = df["CRASH DATE"] + " " + df["CRASH TIME"]
-
-# parse
-df["ts"] = pd.to_datetime(dt, format="%m/%d/%Y %H:%M")
-
-df["time"] = (
-    pd.to_datetime(df["CRASH DATE"] + " " + df["CRASH TIME"], format="%m/%d/%Y %H:%M")
-      .dt.strftime("%Y/%m/%d %H")
+casualty_cols = ["NUMBER OF PERSONS INJURED", "NUMBER OF PERSONS KILLED", "NUMBER OF PEDESTRIANS INJURED", "NUMBER OF PEDESTRIANS KILLED", "NUMBER OF CYCLIST INJURED", "NUMBER OF CYCLIST KILLED", "NUMBER OF MOTORIST INJURED", "NUMBER OF MOTORIST KILLED"]
+
+# read only the needed columns (multithreaded pyarrow parser, explicit dtypes)
+df = pd.read_csv(
+    "../../data/data_raw/CAR_CRASH.csv",
+    engine="pyarrow",
+    usecols=["CRASH DATE", "CRASH TIME", "LATITUDE", "LONGITUDE", *casualty_cols],
+    dtype={"CRASH DATE": str, "CRASH TIME": str, "LATITUDE": "float64", "LONGITUDE": "float64",
+           **{c: "float64" for c in casualty_cols}},
 )
 
+# parse once; the display string is derived from the parsed series
+ts = pd.to_datetime(df["CRASH DATE"] + " " + df["CRASH TIME"], format="%m/%d/%Y %H:%M", cache=True)
+df["ts"] = ts
+df["time"] = ts.dt.strftime("%Y/%m/%d %H")
+
 df = df.sort_values("ts")
 df = df.set_index("ts")
 
-cut = pd.to_datetime("2016-01-04")
-df = df[df.index >= cut]
-
-cut = pd.to_datetime("2022-10-19")
-df = df[df.index <= cut]
+cut_lo = pd.to_datetime("2016-01-04")
+cut_hi = pd.to_datetime("2022-10-19")
+df = df.loc[cut_lo:cut_hi]
 
-cols_to_remain = ["time","LATITUDE","LONGITUDE","NUMBER OF PERSONS INJURED","NUMBER OF PERSONS KILLED","NUMBER OF PEDESTRIANS INJURED","NUMBER OF PEDESTRIANS KILLED","NUMBER OF CYCLIST INJURED","NUMBER OF CYCLIST KILLED","NUMBER OF MOTORIST INJURED","NUMBER OF MOTORIST KILLED"]
+cols_to_remain = ["time", "LATITUDE", "LONGITUDE", *casualty_cols]
 df = df[cols_to_remain]
 df = df.dropna()
 
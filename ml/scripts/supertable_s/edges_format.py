@@ -1,10 +1,9 @@
 import pandas as pd
 
-df = pd.read_csv("../../data/data_raw/EDGES.csv")
-
-
 cols_to_remain = ["the_geom", "RW_TYPE"]
-df = df[cols_to_remain]
+
+# read only the needed columns (multithreaded pyarrow parser)
+df = pd.read_csv("../../data/data_raw/EDGES.csv", engine="pyarrow", usecols=cols_to_remain, dtype={"the_geom": str})
 df = df.rename(columns={"the_geom": "coordinates", "RW_TYPE": "rw_type"})
 df = df.dropna()
 
@@ -1,10 +1,9 @@
 import pandas as pd
 
-df = pd.read_csv("../../data/data_raw/SPEED_LIMITS.csv")
-
-
 cols_to_remain = ["the_geom", "postvz_sl"]
-df = df[cols_to_remain]
+
+# read only the needed columns (multithreaded pyarrow parser)
+df = pd.read_csv("../../data/data_raw/SPEED_LIMITS.csv", engine="pyarrow", usecols=cols_to_remain, dtype={"the_geom": str})
 df = df.rename(columns={"the_geom": "coordinates", "postvz_sl": "speedlimit"})
 df = df.dropna()
 
@@ -1,6 +1,7 @@
 import numpy as np
-from pandas.util import hash_pandas_object
+import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 from tqdm import tqdm
 
@@ -15,64 +16,76 @@ tot_out = pos_out = neg_out = 0
 
 pbar = tqdm(total=pf.num_row_groups, desc="Filtering ~50% negatives per cluster", unit="rg")
 
-def ensure_timestamp_column(df):
-    # If timestamp is the index, bring it back as a column
-    if "timestamp" not in df.columns:
-        if df.index.name == "timestamp":
-            df = df.reset_index()
-        elif "__index_level_0__" in df.columns:
-            df = df.rename(columns={"__index_level_0__": "timestamp"})
+def ensure_timestamp_column(tbl):
+    # A named pandas index is stored as a plain 'timestamp' column; an unnamed one as __index_level_0__
+    names = tbl.column_names
+    if "timestamp" not in names:
+        if "__index_level_0__" in names:
+            src = "__index_level_0__"
         else:
             # Try to detect a single datetime-like column and treat it as timestamp
-            dt_candidates = [c for c in df.columns if np.issubdtype(df[c].dtype, np.datetime64)]
-            if len(dt_candidates) == 1:
-                df = df.rename(columns={dt_candidates[0]: "timestamp"})
-            else:
+            dt_candidates = [f.name for f in tbl.schema if pa.types.is_timestamp(f.type)]
+            if len(dt_candidates) != 1:
                 raise KeyError(
                     "Couldn't find 'timestamp' as a column or index. "
-                    f"Available columns: {list(df.columns)} | index name: {df.index.name}"
+                    f"Available columns: {names}"
                 )
-    return df
+            src = dt_candidates[0]
+        tbl = tbl.rename_columns(["timestamp" if c == src else c for c in names])
+    # Put timestamp first (as reset_index did) and drop pandas metadata so it is
+    # written as a plain column, not restored as index
+    tbl = tbl.select(["timestamp"] + [c for c in tbl.column_names if c != "timestamp"])
+    return tbl.replace_schema_metadata(None)
+
+def _mix64(x):
+    # splitmix64 finalizer (uint64 arithmetic wraps)
+    x = x ^ (x >> np.uint64(30)); x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27)); x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def row_uniform(cluster_id, timestamp):
+    # Deterministic per-row U[0,1) from (cluster_id, timestamp) Arrow columns.
+    # Only the dictionary of distinct cluster ids is hashed; rows gather them by index.
+    cid = cluster_id.combine_chunks()
+    if not pa.types.is_dictionary(cid.type):
+        cid = pc.dictionary_encode(cid)
+    cats = cid.dictionary.to_numpy(zero_copy_only=False).astype(object)
+    cid_h = pd.util.hash_array(cats)[cid.indices.to_numpy()]
+    ts64 = timestamp.to_numpy().astype("datetime64[ns]").view(np.int64).astype(np.uint64)
+    h = _mix64((cid_h * np.uint64(0x9E3779B97F4A7C15)) ^ (ts64 + np.uint64(0x632BE59BD9B4E019)))
+    return (h >> np.uint64(11)) * (1.0 / (1 << 53))
 
 for rg in range(pf.num_row_groups):
-    tbl = pf.read_row_group(rg)  # if you know exact names you can pass columns=[...]
-    df = tbl.to_pandas()         # get a pandas chunk
+    tbl = pf.read_row_group(rg)  # stays in Arrow; no pandas round-trip
 
     # Normalize schema
-    df = ensure_timestamp_column(df)
-    if "cluster_id" not in df.columns:
+    tbl = ensure_timestamp_column(tbl)
+    if "cluster_id" not in tbl.column_names:
         raise KeyError("'cluster_id' missing from columns.")
-    if "label" not in df.columns:
+    if "label" not in tbl.column_names:
         raise KeyError("'label' missing from columns.")
 
     # counters in
-    n = len(df)
-    pos_mask = (df["label"] == 1)
+    n = tbl.num_rows
+    pos_mask = tbl.column("label").to_numpy() == 1
     neg_mask = ~pos_mask
     n_pos = int(pos_mask.sum())
-    n_neg = int(neg_mask.sum())
+    n_neg = n - n_pos
     tot_in += n; pos_in += n_pos; neg_in += n_neg
 
     # deterministic per-row U[0,1) from hash(cluster_id, timestamp)
-    h = hash_pandas_object(
-        df[["cluster_id", "timestamp"]],
-        index=False,
-        categorize=True
-    ).astype(np.uint64)
-    u = (h / np.float64(2**64)).to_numpy()
+    u = row_uniform(tbl.column("cluster_id"), tbl.column("timestamp"))
 
     # keep all positives; for negatives, keep those with u >= 0.5 (drop ~50%)
     keep_mask = pos_mask | (neg_mask & (u >= 0.5))
-    df_out = df.loc[keep_mask]
+    tbl_out = tbl.filter(pa.array(keep_mask))
 
-    # counters out
-    n_out = len(df_out)
-    n_pos_out = int((df_out["label"] == 1).sum())
-    n_neg_out = int((df_out["label"] == 0).sum())
+    # counters out (positives are always kept)
+    n_out = tbl_out.num_rows
+    n_pos_out = n_pos
+    n_neg_out = n_out - n_pos
     tot_out += n_out; pos_out += n_pos_out; neg_out += n_neg_out
 
-    # write/append — do NOT preserve index to avoid hidden __index_level_0__
-    tbl_out = pa.Table.from_pandas(df_out, preserve_index=False)
     if writer is None:
         writer = pq.ParquetWriter(OUT_PARQUET, tbl_out.schema, compression="zstd")
     writer.write_table(tbl_out)
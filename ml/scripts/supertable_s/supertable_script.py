@@ -2,8 +2,9 @@ import os
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely import wkt
-from shapely.geometry import LineString, Point
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
 from tqdm import tqdm
 
 tqdm.pandas()
@@ -16,6 +17,24 @@ def h3_index(lat: float, lon: float, res: int) -> str:
         return h3.latlng_to_cell(lat, lon, res)
     raise RuntimeError("Unsupported h3 API")
 
+def h3_index_array(lats, lons, res: int) -> pd.Categorical:
+    """
+    Vectorized h3_index over coordinate arrays.
+    Uses h3ronpy (single Rust loop, see ml/requirements.txt) when installed, else falls back to h3_index
+    per point: a Python loop, about 2x slower (~1 us per point, ~1 s per million rows).
+    Each distinct cell is formatted to its hex id once; returned as a Categorical.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    try:
+        from h3ronpy.vector import coordinates_to_cells
+        cells = np.asarray(coordinates_to_cells(lats, lons, res), dtype=np.uint64)
+    except ImportError:
+        cells = np.fromiter((int(h3_index(lat, lon, res), 16) for lat, lon in zip(lats, lons)),
+                            dtype=np.uint64, count=len(lats))
+    uniq, codes = np.unique(cells, return_inverse=True)
+    return pd.Categorical.from_codes(codes.ravel(), categories=[format(int(c), "x") for c in uniq])
+
 def h3_center(cell: str):
     import h3
     if hasattr(h3, "h3_to_geo"):          # v3
@@ -26,6 +45,20 @@ def h3_center(cell: str):
         return lat, lon
     raise RuntimeError("Unsupported h3 API")
 
+def h3_center_array(cells):
+    """
+    Vectorized h3_center over hex cell ids; returns (lats, lons) arrays.
+    Uses h3ronpy when installed, else falls back to h3_center per cell.
+    """
+    cells = list(cells)
+    try:
+        from h3ronpy.vector import cells_to_coordinates
+        coords = cells_to_coordinates(np.array([int(c, 16) for c in cells], dtype=np.uint64))
+        return np.asarray(coords["lat"], dtype=np.float64), np.asarray(coords["lng"], dtype=np.float64)
+    except ImportError:
+        lat_lon = np.array([h3_center(c) for c in cells], dtype=np.float64).reshape(-1, 2)
+        return lat_lon[:, 0], lat_lon[:, 1]
+
 # ----------------------------
 # Config / file paths
 # ----------------------------
@@ -51,53 +84,44 @@ H3_RES = 9
 # ----------------------------
 # Helpers
 # ----------------------------
-def parse_multilinestring_to_linestring(wkt_str: str) -> LineString:
-    geom = wkt.loads(wkt_str)
-    if geom.geom_type == "MultiLineString":
-        if len(geom.geoms) == 1:
-            return LineString(list(geom.geoms[0].coords))
-        # merge by chaining coords
-        coords = []
-        for ls in geom.geoms:
-            coords.extend(list(ls.coords))
-        return LineString(coords)
-    elif geom.geom_type == "LineString":
-        return geom
-    raise ValueError(f"Unexpected geometry type: {geom.geom_type}")
-
-def time_score(ts: pd.Timestamp) -> float:
+def parse_multilinestrings_to_linestrings(wkt_arr) -> np.ndarray:
     """
-    Spec-driven scoring (0..1).
-
-    Weekdays (Mon–Fri):
-      Rush 06–10, 16–20 => 1.00
-      Midday 10–16      => 0.65
-      Eve 20–23         => 0.45
-      Night 23–06       => 0.20
-
-    Weekends (Sat–Sun):
-      Rush 10–16        => 1.00
-      Other daytime 07–10, 16–20 => 0.55
-      Night 20–07       => 0.20
+    Parse an array of WKT (MULTI)LINESTRINGs into LineStrings in one GEOS call.
+    MultiLineStrings are collapsed by chaining their parts' coordinates.
     """
-    h = ts.hour
-    wd = ts.weekday()  # 0=Mon,...,6=Sun
-    is_weekend = wd >= 5
-
-    if not is_weekend:
-        if (6 <= h < 10) or (16 <= h < 20):
-            return 1.0
-        if 10 <= h < 16:
-            return 0.65
-        if 20 <= h < 23:
-            return 0.45
-        return 0.20  # 23–06
-    else:
-        if 10 <= h < 16:
-            return 1.0
-        if (7 <= h < 10) or (16 <= h < 20):
-            return 0.55
-        return 0.20  # 20–07
+    geoms = shapely.from_wkt(np.asarray(wkt_arr, dtype=object))
+    type_ids = shapely.get_type_id(geoms)
+    bad = ~np.isin(type_ids, (1, 5))  # LineString, MultiLineString
+    if bad.any():
+        raise ValueError(f"Unexpected geometry type id(s): {np.unique(type_ids[bad]).tolist()}")
+    multi = type_ids == 5
+    if multi.any():
+        coords, idx = shapely.get_coordinates(geoms[multi], return_index=True)
+        geoms[multi] = shapely.linestrings(coords, indices=idx)
+    return geoms
+
+# Spec-driven time scoring (0..1), indexed by hour of day.
+#
+# Weekdays (Mon–Fri):
+#   Rush 06–10, 16–20 => 1.00
+#   Midday 10–16      => 0.65
+#   Eve 20–23         => 0.45
+#   Night 23–06       => 0.20
+#
+# Weekends (Sat–Sun):
+#   Rush 10–16        => 1.00
+#   Other daytime 07–10, 16–20 => 0.55
+#   Night 20–07       => 0.20
+WEEKDAY_TIME_SCORES = np.full(24, 0.20)
+WEEKDAY_TIME_SCORES[6:10] = 1.0
+WEEKDAY_TIME_SCORES[16:20] = 1.0
+WEEKDAY_TIME_SCORES[10:16] = 0.65
+WEEKDAY_TIME_SCORES[20:23] = 0.45
+
+WEEKEND_TIME_SCORES = np.full(24, 0.20)
+WEEKEND_TIME_SCORES[10:16] = 1.0
+WEEKEND_TIME_SCORES[7:10] = 0.55
+WEEKEND_TIME_SCORES[16:20] = 0.55
 
 def normalize_series_01(s: pd.Series) -> pd.Series:
     vmin, vmax = s.min(), s.max()
@@ -108,8 +132,9 @@ def normalize_series_01(s: pd.Series) -> pd.Series:
 # ----------------------------
 # Load edges & speed limits
 # ----------------------------
-edges = pd.read_csv(EDGES_CSV)
-edges["geometry"] = edges["coordinates"].apply(parse_multilinestring_to_linestring)
+# Multithreaded pyarrow CSV parser, WKT column only parsed once by from_wkt below
+edges = pd.read_csv(EDGES_CSV, engine="pyarrow", usecols=["coordinates", "rw_type"])
+edges["geometry"] = parse_multilinestrings_to_linestrings(edges["coordinates"].to_numpy())
 g_edges = gpd.GeoDataFrame(edges.drop(columns=["coordinates"]),
                            geometry="geometry", crs=CRS_GEO).to_crs(CRS_M)
 g_edges["edge_id"] = np.arange(len(g_edges))
@@ -123,15 +148,17 @@ g_edges["rw_score"] = g_edges["rw_type"].map(rw_map)
 g_edges["rw_score"] = g_edges["rw_score"].fillna(0.6)
 
 # Speed limits
-sl = pd.read_csv(SPEEDLIMIT_CSV)
-sl["geometry"] = sl["coordinates"].apply(parse_multilinestring_to_linestring)
+sl = pd.read_csv(SPEEDLIMIT_CSV, engine="pyarrow", usecols=["coordinates", "speedlimit"])
+sl["geometry"] = parse_multilinestrings_to_linestrings(sl["coordinates"].to_numpy())
 g_sl = gpd.GeoDataFrame(sl.drop(columns=["coordinates"]), geometry="geometry", crs=CRS_GEO).to_crs(CRS_M)
 
 # --------------------------------------------
 
+# Midpoint along each line in projected CRS (meters); reused for speed limits and H3
+midpoints_m = shapely.line_interpolate_point(g_edges.geometry.values, 0.5, normalized=True)
+
 # Attach speedlimit to edges by nearest line (centroid along line)
-centroids = g_edges.geometry.interpolate(0.5, normalized=True)
-pts = gpd.GeoDataFrame({"edge_idx": g_edges.index}, geometry=centroids, crs=g_edges.crs)
+pts = gpd.GeoDataFrame({"edge_idx": g_edges.index}, geometry=midpoints_m, crs=g_edges.crs)
 
 g_edges["speedlimit"] = np.nan
 g_edges["sl_dist_ft"] = np.nan
@@ -147,24 +174,15 @@ try:
     g_edges.loc[joined["edge_idx"], "speedlimit"] = joined["speedlimit"].to_numpy()
     g_edges.loc[joined["edge_idx"], "sl_dist_ft"] = joined["sl_dist_ft"].to_numpy()
 except Exception:
-    # Fallback: manual spatial index nearest
-    sidx = g_sl.sindex
+    # Fallback: bulk nearest query on an STRtree (single C-level call, threshold applied in the tree)
+    tree = shapely.STRtree(g_sl.geometry.values)
+    (src_idx, tgt_idx), d = tree.query_nearest(
+        pts.geometry.values, max_distance=DIST_THRESH_M, return_distance=True, all_matches=False
+    )
     spd = np.full(len(g_edges), np.nan, dtype=float)
     dist = np.full(len(g_edges), np.nan, dtype=float)
-    for i, c in tqdm(enumerate(pts.geometry.values), total=len(pts), desc="Finding nearest speed limits"):
-        try:
-            cand_idx = next(iter(sidx.nearest(c.bounds, num_results=1)))
-        except Exception:
-            cand_list = list(sidx.intersection(c.bounds))
-            if not cand_list:
-                continue
-            dists = g_sl.geometry.iloc[cand_list].distance(c).to_numpy()
-            cand_idx = cand_list[int(np.nanargmin(dists))]
-        line = g_sl.geometry.iloc[cand_idx]
-        d = c.distance(line)  # feet
-        if d <= DIST_THRESH_M:
-            spd[i] = float(g_sl["speedlimit"].iloc[cand_idx])
-            dist[i] = d
+    spd[src_idx] = g_sl["speedlimit"].to_numpy(dtype=float)[tgt_idx]
+    dist[src_idx] = d
     g_edges["speedlimit"] = spd
     g_edges["sl_dist_ft"] = dist
 
@@ -178,32 +196,40 @@ else:
 # ----------------------------
 # H3 clusters (canonical)
 # ----------------------------
-# Interpolate midpoints in projected CRS (meters)
-midpoints_m = g_edges.geometry.interpolate(0.5, normalized=True)
-
-# Convert those points to lat/lon for H3
+# Convert the midpoints to lat/lon for H3
 midpoints_ll = gpd.GeoSeries(midpoints_m, crs=CRS_M).to_crs(CRS_GEO)
 
-# h3 expects (lat, lon)
-g_edges["cluster_id"] = [
-    h3_index(pt.y, pt.x, H3_RES) for pt in midpoints_ll
-]
-
-# Cluster aggregates (avg over member edges)
-cluster_stats = g_edges.groupby("cluster_id").agg(
-    n_edges=("edge_id", "count"),
-    avg_rw=("rw_score", "mean"),
-    avg_speed=("speed_score", "mean")
-).reset_index()
+# h3 expects (lat, lon); one vectorized call, stored as a Categorical
+g_edges["cluster_id"] = h3_index_array(midpoints_ll.y.to_numpy(), midpoints_ll.x.to_numpy(), H3_RES)
+
+# Cluster aggregates (avg over member edges), binned on the categorical codes:
+# codes are already 0..K-1 in sorted cluster_id order, so no hashing or sorting is needed
+cluster_codes = g_edges["cluster_id"].cat.codes.to_numpy()
+n_cats = len(g_edges["cluster_id"].cat.categories)
+
+def cluster_mean(values: np.ndarray) -> np.ndarray:
+    # NaN-skipping per-cluster mean (like groupby.mean); NaN for clusters with no values
+    ok = ~np.isnan(values)
+    sums = np.bincount(cluster_codes, weights=np.where(ok, values, 0.0), minlength=n_cats)
+    counts = np.bincount(cluster_codes, weights=ok, minlength=n_cats)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+n_edges = np.bincount(cluster_codes, minlength=n_cats)
+cluster_stats = pd.DataFrame({
+    "cluster_id": pd.Categorical.from_codes(np.arange(n_cats), dtype=g_edges["cluster_id"].dtype),
+    "n_edges": n_edges,
+    "avg_rw": cluster_mean(g_edges["rw_score"].to_numpy(dtype=float)),
+    "avg_speed": cluster_mean(g_edges["speed_score"].to_numpy(dtype=float)),
+})
+cluster_stats = cluster_stats[n_edges > 0].reset_index(drop=True)
 
 cluster_centers = cluster_stats[["cluster_id"]].copy()
-cluster_centers["lat"], cluster_centers["lon"] = zip(
-    *cluster_centers["cluster_id"].map(h3_center)
-)
+center_lat, center_lon = h3_center_array(cluster_centers["cluster_id"].astype(str))
 
-# Convert to radians first
-lat_rad = np.radians(cluster_centers["lat"])
-lon_rad = np.radians(cluster_centers["lon"])
+# Convert to radians first (float32: the columns are stored as float32 anyway)
+lat_rad = np.radians(center_lat.astype(np.float32))
+lon_rad = np.radians(center_lon.astype(np.float32))
 
 # Compute sine and cosine for each
 cluster_centers["lat_sin"] = np.sin(lat_rad)
@@ -211,9 +237,6 @@ cluster_centers["lat_cos"] = np.cos(lat_rad)
 cluster_centers["lon_sin"] = np.sin(lon_rad)
 cluster_centers["lon_cos"] = np.cos(lon_rad)
 
-# Drop raw coordinates if you no longer need them
-cluster_centers.drop(columns=["lat", "lon"], inplace=True)
-
 global_speed_mean = g_edges["speed_score"].mean()
 cluster_stats["avg_speed"] = cluster_stats["avg_speed"].fillna(global_speed_mean if not np.isnan(global_speed_mean) else 0.5)
 cluster_stats["avg_rw"]    = cluster_stats["avg_rw"].fillna(0.6)  # neutral default
@@ -225,7 +248,9 @@ t_start = pd.Timestamp("2016-01-04 00:00:00")
 t_end   = pd.Timestamp("2022-10-19 23:59:59")
 time_index_4h = pd.date_range(t_start, t_end, freq="4h")
 
-time_scores = pd.Series([time_score(ts) for ts in time_index_4h],
+hours = time_index_4h.hour.to_numpy()
+is_weekend = time_index_4h.weekday.to_numpy() >= 5  # 0=Mon,...,6=Sun
+time_scores = pd.Series(np.where(is_weekend, WEEKEND_TIME_SCORES[hours], WEEKDAY_TIME_SCORES[hours]),
                         index=time_index_4h, name="time_score")
 
 # ----------------------------
@@ -242,13 +267,16 @@ for c in num_cols:
 weather_4h = weather[num_cols].resample("4h", label="left", closed="left").mean()
 weather_4h = weather_4h.reindex(time_index_4h)
 
-for col in num_cols:
-    x = weather_4h[col]
-    vmin, vmax = x.min(), x.max()
-    if pd.isna(vmin) or pd.isna(vmax) or vmax == vmin:
-        weather_4h[col] = 0.0
-    else:
-        weather_4h[col] = (x - vmin) / (vmax - vmin)
+# Min-max all columns at once in float32; fmin/fmax skip NaN (NaN only if a column is all-NaN).
+# Constant or all-NaN columns become 0.0
+w = weather_4h[num_cols].to_numpy(dtype=np.float32, copy=True)
+vmin, vmax = np.fmin.reduce(w, axis=0), np.fmax.reduce(w, axis=0)
+span = vmax - vmin
+degenerate = ~(span > 0)
+w -= vmin
+w /= np.where(degenerate, 1, span)
+w[:, degenerate] = 0.0
+weather_4h = pd.DataFrame(w, index=weather_4h.index, columns=num_cols)
 
 # ----------------------------
 # Crashes: snap to nearest edge (≤60 m), aggregate per 4h & cluster
@@ -272,30 +300,15 @@ try:
     )
     snapped = snapped[snapped["cr_dist_ft"] <= DIST_THRESH_M].copy()
 except Exception:
-    sidx = edges_for_join.sindex
-    edge_id_arr = np.full(len(g_cr), np.nan)
-    cluster_id_arr = np.full(len(g_cr), np.nan)
-    dist_arr = np.full(len(g_cr), np.nan)
-    for i, p in tqdm(enumerate(g_cr.geometry.values), total=len(g_cr), desc="Snapping crashes to nearest edges"):
-        try:
-            cand_idx = next(iter(sidx.nearest(p.bounds, num_results=1)))
-        except Exception:
-            cand_list = list(sidx.intersection(p.bounds))
-            if not cand_list:
-                continue
-            dists = edges_for_join.geometry.iloc[cand_list].distance(p).to_numpy()
-            cand_idx = cand_list[int(np.nanargmin(dists))]
-        line = edges_for_join.geometry.iloc[cand_idx]
-        d = p.distance(line)  # feet
-        if d <= DIST_THRESH_M:
-            edge_id_arr[i] = edges_for_join["edge_id"].iloc[cand_idx]
-            cluster_id_arr[i] = edges_for_join["cluster_id"].iloc[cand_idx]
-            dist_arr[i] = d
-    snapped = g_cr.copy()
-    snapped["edge_id"] = edge_id_arr
-    snapped["cluster_id"] = cluster_id_arr
-    snapped["cr_dist_ft"] = dist_arr
-    snapped = snapped.dropna(subset=["cluster_id"])
+    # Fallback: bulk nearest query on an STRtree; crashes beyond the threshold get no match
+    tree = shapely.STRtree(edges_for_join.geometry.values)
+    (src_idx, tgt_idx), d = tree.query_nearest(
+        g_cr.geometry.values, max_distance=DIST_THRESH_M, return_distance=True, all_matches=False
+    )
+    snapped = g_cr.iloc[src_idx].copy()
+    snapped["edge_id"] = edges_for_join["edge_id"].to_numpy()[tgt_idx]
+    snapped["cluster_id"] = edges_for_join["cluster_id"].array.take(tgt_idx)
+    snapped["cr_dist_ft"] = d
 
 # 4-hour bin from crash time
 snapped["t4h"] = pd.to_datetime(snapped["time"], format="%Y/%m/%d %H", errors="coerce").dt.floor("4h")
@@ -306,16 +319,15 @@ casualty_cols = [
     "NUMBER OF CYCLIST INJURED","NUMBER OF CYCLIST KILLED",
     "NUMBER OF MOTORIST INJURED","NUMBER OF MOTORIST KILLED"
 ]
-snapped["casualties_total"] = snapped[casualty_cols].fillna(0).sum(axis=1)
+# nansum treats missing counts as 0 without a fillna copy of all eight columns
+snapped["casualties_total"] = np.nansum(snapped[casualty_cols].to_numpy(dtype=np.float32), axis=1, dtype=np.float32)
 
-cr_agg = (snapped.groupby(["cluster_id", "t4h"])["casualties_total"].sum()
+cr_agg = (snapped.groupby(["cluster_id", "t4h"], observed=True)["casualties_total"].sum()
           .to_frame().reset_index())
 
-cr_agg = cr_agg.merge(cluster_stats[["cluster_id", "n_edges"]], on="cluster_id", how="left")
-cr_agg["n_edges"] = cr_agg["n_edges"].clip(lower=1)
-cr_agg["casualties_avg_per_edge"] = cr_agg["casualties_total"] / cr_agg["n_edges"]
-
-labels = cr_agg.assign(label=(cr_agg["casualties_avg_per_edge"] >= 0).astype(int))[["cluster_id", "t4h", "label"]]
+# Casualty counts are >= 0, so every (cluster, 4h) bin with a snapped crash is a positive
+labels = cr_agg[["cluster_id", "t4h"]].copy()
+labels["label"] = np.int8(1)
 
 # ----------------------------
 # Synthetic traffic per cluster & 4h bin
@@ -323,52 +335,62 @@ labels = cr_agg.assign(label=(cr_agg["casualties_avg_per_edge"] >= 0).astype(int
 WEIGHT_RW, WEIGHT_TIME, WEIGHT_SPEED = 0.45, 0.35, 0.15
 MAX_SUM = WEIGHT_RW + WEIGHT_TIME + WEIGHT_SPEED  # 0.95
 
-clusters_df = cluster_stats[["cluster_id", "avg_rw", "avg_speed"]].copy()
-clusters_df["key"] = 1
-ts_df = time_scores.rename("time_score").to_frame().reset_index().rename(columns={"index": "t4h"})
-ts_df["key"] = 1
-
-print(f"Combining {len(clusters_df)} clusters × {len(ts_df)} time bins ≈ {len(clusters_df)*len(ts_df):,} rows...")
-grid = clusters_df.merge(ts_df, on="key").drop(columns=["key"])
+n_clusters, n_times = len(cluster_stats), len(time_index_4h)
+print(f"Combining {n_clusters} clusters × {n_times} time bins ≈ {n_clusters*n_times:,} rows...")
 
-grid["traffic_raw"] = (
-    WEIGHT_RW*grid["avg_rw"] +
-    WEIGHT_TIME*grid["time_score"] +
-    WEIGHT_SPEED*grid["avg_speed"]
-)
-
-WEIGHT_RW, WEIGHT_TIME, WEIGHT_SPEED = 0.45, 0.35, 0.15
-MAX_SUM = WEIGHT_RW + WEIGHT_TIME + WEIGHT_SPEED  # 0.95
-grid["traffic_raw"] = WEIGHT_RW*grid["avg_rw"] + WEIGHT_TIME*grid["time_score"] + WEIGHT_SPEED*grid["avg_speed"]
-grid["traffic_volume"] = (grid["traffic_raw"] / MAX_SUM).clip(0, 1)
-traffic = grid[["cluster_id", "t4h", "traffic_volume"]].copy()
+# Traffic splits into a per-cluster term (C,) and a per-time term (T,);
+# broadcast to a (C, T) grid instead of cross-merging cluster and time frames.
+cluster_term = WEIGHT_RW*cluster_stats["avg_rw"].to_numpy() + WEIGHT_SPEED*cluster_stats["avg_speed"].to_numpy()
+time_term = WEIGHT_TIME*time_scores.to_numpy()
+# traffic_raw is computed once and normalized in place (no extra (C, T) temporaries)
+traffic_volume = cluster_term[:, None] + time_term[None, :]
+np.divide(traffic_volume, MAX_SUM, out=traffic_volume)
+np.clip(traffic_volume, 0, 1, out=traffic_volume)
 
 # ----------------------------
-# Base grid: (cluster × time) × weather
+# Base grid: (cluster × time) × weather, cluster-major
 # ----------------------------
-weather_4h_reset = weather_4h.reset_index().rename(columns={"index": "t4h"})
-weather_4h_reset["t4h"] = pd.to_datetime(weather_4h_reset["t4h"])
-weather_4h_reset["key"] = 1
-
-clusters_only = cluster_stats[["cluster_id"]].copy()
-clusters_only = clusters_only.merge(cluster_centers, on="cluster_id", how="left")
-clusters_only["key"] = 1
-
-base = clusters_only.merge(weather_4h_reset, on="key").drop(columns=["key"])
-
-# Join traffic + labels
-base = base.merge(traffic, on=["cluster_id", "t4h"], how="left")
-base = base.merge(labels, on=["cluster_id", "t4h"], how="left")
-base["label"] = base["label"].fillna(0).astype(int)
-
-# Final schema & index
+# Row r covers cluster r // n_times and time bin r % n_times, so per-cluster
+# columns are repeated and per-time columns are tiled. cluster_stats comes out
+# of groupby sorted by cluster_id, so rows are sorted by (cluster_id, timestamp)
+# and every row group holds a narrow cluster_id range in its statistics.
+# cluster_centers was built from cluster_stats, so both share row order.
+cluster_ids = cluster_stats["cluster_id"]
+base = {
+    "cluster_id": pd.Categorical.from_codes(np.repeat(cluster_ids.cat.codes.to_numpy(), n_times),
+                                            dtype=cluster_ids.dtype),
+}
+# Floats are stored as float32 and the label as int8 to halve write bandwidth and file size
+for col in ["lat_sin", "lat_cos", "lon_sin", "lon_cos"]:
+    base[col] = np.repeat(cluster_centers[col].to_numpy(np.float32), n_times)
+for col in num_cols:
+    base[col] = np.tile(weather_4h[col].to_numpy(np.float32), n_clusters)
+base["traffic_volume"] = traffic_volume.astype(np.float32).ravel()
+
+# Labels: scatter into the grid by (cluster, time) position instead of a hash join
+label = np.zeros(n_clusters*n_times, dtype=np.int8)
+c_pos = pd.Index(cluster_ids).get_indexer(labels["cluster_id"])
+t_pos = time_index_4h.get_indexer(labels["t4h"])
+hit = (c_pos >= 0) & (t_pos >= 0)
+label[c_pos[hit]*n_times + t_pos[hit]] = labels["label"].to_numpy()[hit]
+base["label"] = label
+
+# Final schema & index (already sorted by cluster_id, timestamp)
 final_cols = ["cluster_id", "lat_sin", "lat_cos", "lon_sin", "lon_cos", "temperature", "precipitation", "rain", "cloudcover", "windspeed", "traffic_volume", "label"]
-supertable = base.set_index("t4h").sort_index()[final_cols].copy()
-supertable.index.name = "timestamp"
+supertable = pd.DataFrame(base, index=pd.DatetimeIndex(np.tile(time_index_4h, n_clusters), name="timestamp"))[final_cols]
 
 # ----------------------------
 # Save
 # ----------------------------
 os.makedirs(OUT_DIR, exist_ok=True)
-supertable.to_parquet(OUT_PARQUET, index=True)
+# Column statistics + sorted rows let readers skip row groups via predicate pushdown;
+# cluster_id is categorical -> dictionary-encoded in parquet
+pq.write_table(
+    pa.Table.from_pandas(supertable, preserve_index=True),
+    OUT_PARQUET,
+    compression="zstd",
+    row_group_size=500_000,
+    write_statistics=True,
+    use_dictionary=["cluster_id"],
+)
 print("Done. Rows:", len(supertable), "| Clusters:", cluster_stats.shape[0], "| Saved to:", OUT_PARQUET)
@@ -1,22 +1,29 @@
 import pandas as pd
 
-df = pd.read_csv("../../data/data_raw/NYC_WEATHER.csv")
-
-# parse
-df["ts"] = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M")
-
-df["time"] = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M").dt.strftime("%Y/%m/%d %H")
+measure_cols = ["temperature_2m (°C)", "precipitation (mm)", "rain (mm)", "cloudcover (%)", "windspeed_10m (km/h)"]
+
+# read only the needed columns (multithreaded pyarrow parser, explicit dtypes);
+# pyarrow parses the ISO 'time' column to datetime itself, so it is left untyped
+df = pd.read_csv(
+    "../../data/data_raw/NYC_WEATHER.csv",
+    engine="pyarrow",
+    usecols=["time", *measure_cols],
+    dtype={c: "float64" for c in measure_cols},
+)
+
+# parse once; the display string is derived from the parsed series
+ts = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M", cache=True)
+df["ts"] = ts
+df["time"] = ts.dt.strftime("%Y/%m/%d %H")
 
 df = df.sort_values("ts")
 df = df.set_index("ts")
 
-cut = pd.to_datetime("2016-01-04")
-df = df[df.index >= cut]
-
-cut = pd.to_datetime("2022-10-19")
-df = df[df.index <= cut]
+cut_lo = pd.to_datetime("2016-01-04")
+cut_hi = pd.to_datetime("2022-10-19")
+df = df.loc[cut_lo:cut_hi]
 
-cols_to_remain = ["time","temperature_2m (°C)","precipitation (mm)","rain (mm)","cloudcover (%)","windspeed_10m (km/h)"]
+cols_to_remain = ["time", *measure_cols]
 df = df[cols_to_remain]
 df = df.rename(columns={"temperature_2m (°C)": "temperature", "precipitation (mm)": "precipitation", "rain (mm)": "rain", "cloudcover (%)": "cloudcover", "windspeed_10m (km/h)": "windspeed"})
 df = df.dropna()
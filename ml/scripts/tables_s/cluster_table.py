@@ -17,27 +17,14 @@ COORD_FEATS = ["lat_sin", "lat_cos", "lon_sin", "lon_cos"]
 
 def build_cluster_coords():
     # Load only what's needed
-    df = pd.read_parquet(SUPER_PARQUET, columns=[GROUP] + COORD_FEATS)
-
-    # Check if coords are constant within each cluster
-    nunq = df.groupby(GROUP)[COORD_FEATS].nunique(dropna=False)
-    coords_constant = (nunq.max() <= 1).all()
-
-    if coords_constant:
-        # One set of coords per cluster already → take the first occurrence
-        cluster_data = (
-            df.drop_duplicates(subset=[GROUP])
-              .loc[:, [GROUP] + COORD_FEATS]
-              .sort_values(GROUP)
-              .reset_index(drop=True)
-        )
-    else:
-        # Coords vary (e.g., multiple time slices) → use mean per cluster
-        cluster_data = (
-            df.groupby(GROUP, as_index=False)[COORD_FEATS].mean()
-              .sort_values(GROUP)
-              .reset_index(drop=True)
-        )
+    df = pd.read_parquet(SUPER_PARQUET, columns=[GROUP] + COORD_FEATS, engine="pyarrow")
+
+    # Coords come from the H3 cell center, so they are constant per cluster → take the first occurrence
+    cluster_data = (
+        df.drop_duplicates(subset=[GROUP])
+          .sort_values(GROUP)
+          .reset_index(drop=True)
+    )
 
     cluster_data["temperature"] = TEMPERATURE
     cluster_data["precipitation"] = PRECIPITATION
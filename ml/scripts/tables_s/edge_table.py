@@ -2,8 +2,7 @@ import os
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely import wkt
-from shapely.geometry import LineString
+import shapely
 import lightgbm as lgb
 
 
@@ -25,18 +24,21 @@ H3_RES = 9
 # ----------------------------
 # Helpers
 # ----------------------------
-def parse_multilinestring_to_linestring(wkt_str: str) -> LineString:
-    geom = wkt.loads(wkt_str)
-    if geom.geom_type == "MultiLineString":
-        if len(geom.geoms) == 1:
-            return LineString(list(geom.geoms[0].coords))
-        coords = []
-        for ls in geom.geoms:
-            coords.extend(list(ls.coords))
-        return LineString(coords)
-    elif geom.geom_type == "LineString":
-        return geom
-    raise ValueError(f"Unexpected geometry type: {geom.geom_type}")
+def parse_multilinestrings_to_linestrings(wkt_arr) -> np.ndarray:
+    """
+    Parse an array of WKT (MULTI)LINESTRINGs into LineStrings in one GEOS call.
+    MultiLineStrings are collapsed by chaining their parts' coordinates.
+    """
+    geoms = shapely.from_wkt(np.asarray(wkt_arr, dtype=object))
+    type_ids = shapely.get_type_id(geoms)
+    bad = ~np.isin(type_ids, (1, 5))  # LineString, MultiLineString
+    if bad.any():
+        raise ValueError(f"Unexpected geometry type id(s): {np.unique(type_ids[bad]).tolist()}")
+    multi = type_ids == 5
+    if multi.any():
+        coords, idx = shapely.get_coordinates(geoms[multi], return_index=True)
+        geoms[multi] = shapely.linestrings(coords, indices=idx)
+    return geoms
 
 def h3_index(lat: float, lon: float, res: int) -> str:
     import h3
@@ -46,11 +48,30 @@ def h3_index(lat: float, lon: float, res: int) -> str:
         return h3.latlng_to_cell(lat, lon, res)
     raise RuntimeError("Unsupported h3 API")
 
+def h3_index_array(lats, lons, res: int) -> pd.Categorical:
+    """
+    Vectorized h3_index over coordinate arrays.
+    Uses h3ronpy (single Rust loop, see ml/requirements.txt) when installed, else falls back to h3_index
+    per point: a Python loop, about 2x slower (~1 us per point, ~1 s per million rows).
+    Each distinct cell is formatted to its hex id once; returned as a Categorical.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    try:
+        from h3ronpy.vector import coordinates_to_cells
+        cells = np.asarray(coordinates_to_cells(lats, lons, res), dtype=np.uint64)
+    except ImportError:
+        cells = np.fromiter((int(h3_index(lat, lon, res), 16) for lat, lon in zip(lats, lons)),
+                            dtype=np.uint64, count=len(lats))
+    uniq, codes = np.unique(cells, return_inverse=True)
+    return pd.Categorical.from_codes(codes.ravel(), categories=[format(int(c), "x") for c in uniq])
+
 # ----------------------------
 # Load edges
 # ----------------------------
-edges = pd.read_csv(EDGES_CSV)
-edges["geometry"] = edges["coordinates"].apply(parse_multilinestring_to_linestring)
+# Multithreaded pyarrow CSV parser, WKT column only parsed once by from_wkt below
+edges = pd.read_csv(EDGES_CSV, engine="pyarrow", usecols=["coordinates", "rw_type"])
+edges["geometry"] = parse_multilinestrings_to_linestrings(edges["coordinates"].to_numpy())
 
 # GeoDataFrames
 g_edges_ll = gpd.GeoDataFrame(edges.drop(columns=["coordinates"]),
@@ -60,30 +81,27 @@ g_edges_m  = g_edges_ll.to_crs(CRS_M).copy()
 # Edge ids
 g_edges_m["edge_id"] = np.arange(len(g_edges_m))
 
-# Start / end / midpoint (in meters CRS), then convert to lon/lat
-starts_m = g_edges_m.geometry.interpolate(0.0, normalized=True)
-ends_m   = g_edges_m.geometry.interpolate(1.0, normalized=True)
-mids_m   = g_edges_m.geometry.interpolate(0.5, normalized=True)
-
-starts_ll = gpd.GeoSeries(starts_m, crs=CRS_M).to_crs(CRS_GEO)
-ends_ll   = gpd.GeoSeries(ends_m,   crs=CRS_M).to_crs(CRS_GEO)
-mids_ll   = gpd.GeoSeries(mids_m,   crs=CRS_M).to_crs(CRS_GEO)
+# Start / mid / end (in meters CRS) in one broadcast GEOS call, then convert all to lon/lat at once
+pts_m = shapely.line_interpolate_point(g_edges_m.geometry.to_numpy()[:, None], [0.0, 0.5, 1.0], normalized=True)
+pts_ll = gpd.GeoSeries(pts_m.ravel(), crs=CRS_M).to_crs(CRS_GEO)
+lon_ll = pts_ll.x.to_numpy().reshape(-1, 3)
+lat_ll = pts_ll.y.to_numpy().reshape(-1, 3)
 
 # Length in meters
 length_m = g_edges_m.geometry.length
 
 # Cluster (H3) from midpoint lon/lat
-mid_lon = mids_ll.x.values
-mid_lat = mids_ll.y.values
-cluster_ids = [h3_index(lat, lon, H3_RES) for lat, lon in zip(mid_lat, mid_lon)]
+mid_lon = lon_ll[:, 1]
+mid_lat = lat_ll[:, 1]
+cluster_ids = h3_index_array(mid_lat, mid_lon, H3_RES)
 
 # Assemble output
 out = pd.DataFrame({
     "edge_id":   g_edges_m["edge_id"].astype(int),
-    "start_lon": starts_ll.x.values,
-    "start_lat": starts_ll.y.values,
-    "end_lon":   ends_ll.x.values,
-    "end_lat":   ends_ll.y.values,
+    "start_lon": lon_ll[:, 0],
+    "start_lat": lat_ll[:, 0],
+    "end_lon":   lon_ll[:, 2],
+    "end_lat":   lat_ll[:, 2],
     "mid_lon":   mid_lon,
     "mid_lat":   mid_lat,
     "length_m":  length_m.values,
@@ -104,27 +122,27 @@ out = out.merge(cluster_df, on='cluster_id', how='left')
 EDGES_PROCESSED_CSV = "../../data/data_processed/edges.csv"  # columns: coordinates, rw_type
 SPEEDLIMIT_CSV      = "../../data/data_processed/speedlimit.csv"       # columns: coordinates, speedlimit
 
-def linestring_key(ls: LineString, decimals: int = 6) -> str:
+def linestring_keys(geoms, decimals: int = 6) -> np.ndarray:
     """
-    Build a stable key from a LineString by rounding coordinates.
-    This makes sure equal geometries (from different files) match exactly.
+    Build stable uint64 keys for an array of LineStrings by rounding coordinates
+    and hashing their WKB. This makes sure equal geometries (from different files) match exactly.
     """
-    pts = [f"{x:.{decimals}f},{y:.{decimals}f}" for x, y in ls.coords]
-    return ";".join(pts)
+    rounded = shapely.transform(np.asarray(geoms, dtype=object), lambda c: np.round(c, decimals))
+    return pd.util.hash_array(shapely.to_wkb(rounded, output_dimension=2).astype(object))
 
 edges_key_map = pd.DataFrame({
     "edge_id": g_edges_m["edge_id"].astype(int).values,
-    "geom_key": g_edges_ll.geometry.apply(linestring_key).values
+    "geom_key": linestring_keys(g_edges_ll.geometry.values)
 })
 
-ep = pd.read_csv(EDGES_PROCESSED_CSV, usecols=["coordinates", "rw_type"])
-ep["geometry"] = ep["coordinates"].apply(parse_multilinestring_to_linestring)
-ep["geom_key"] = ep["geometry"].apply(linestring_key)
+ep = pd.read_csv(EDGES_PROCESSED_CSV, engine="pyarrow", usecols=["coordinates", "rw_type"])
+ep["geometry"] = parse_multilinestrings_to_linestrings(ep["coordinates"].to_numpy())
+ep["geom_key"] = linestring_keys(ep["geometry"].to_numpy())
 ep = ep.drop(columns=["coordinates", "geometry"]).drop_duplicates(subset=["geom_key"])
 
-sl = pd.read_csv(SPEEDLIMIT_CSV, usecols=["coordinates", "speedlimit"])
-sl["geometry"] = sl["coordinates"].apply(parse_multilinestring_to_linestring)
-sl["geom_key"] = sl["geometry"].apply(linestring_key)
+sl = pd.read_csv(SPEEDLIMIT_CSV, engine="pyarrow", usecols=["coordinates", "speedlimit"])
+sl["geometry"] = parse_multilinestrings_to_linestrings(sl["coordinates"].to_numpy())
+sl["geom_key"] = linestring_keys(sl["geometry"].to_numpy())
 sl = sl.drop(columns=["coordinates", "geometry"]).drop_duplicates(subset=["geom_key"])
 
 attr = edges_key_map.merge(ep[["geom_key", "rw_type"]], on="geom_key", how="left") \
@@ -168,14 +186,18 @@ def load_model(path: str) -> lgb.Booster:
     return booster
 
 def predict_batch(booster: lgb.Booster, df: pd.DataFrame) -> np.ndarray:
-    X = df[FEATURES].astype(np.float32).replace([np.inf, -np.inf], np.nan)
+    # One contiguous float32 matrix, infs mapped to NaN in place (no intermediate DataFrames)
+    X = np.ascontiguousarray(df[FEATURES].to_numpy(dtype=np.float32))
+    X[~np.isfinite(X)] = np.nan
     return booster.predict(X, num_iteration=booster.best_iteration)
 
 booster = load_model("../../model/main_model.lgb")
-out["risk_score"] = predict_batch(booster, out)
-max_r = out["risk_score"].max()
-min_r = out["risk_score"].min()
-out["risk_score"] = (out["risk_score"] - min_r) / (max_r - min_r)
+# Min-max normalize the raw predictions in place before they become a column
+risk = predict_batch(booster, out)
+min_r, max_r = np.nanmin(risk), np.nanmax(risk)
+np.subtract(risk, min_r, out=risk)
+np.divide(risk, max_r - min_r, out=risk)
+out["risk_score"] = risk
 
 os.makedirs(OUT_DIR, exist_ok=True)
 out.to_parquet(OUT_PARQUET, index=False)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+from itertools import chain
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import geopandas as gpd
-from typing import Iterable, List, Tuple, Dict, Set
-from shapely.geometry import Point, LineString
+import shapely
+from typing import Tuple
+from shapely.geometry import Point
 from shapely.strtree import STRtree
 
 
@@ -41,38 +46,148 @@ def _extract_points(geom):
     return []
 
 
-def _make_tree_and_index(geoms: Iterable):
+def _intersection_points(inters: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Build an STRtree in a way that works with both Shapely 1.x and 2.x.
-    Returns:
-      tree: STRtree
-      geoms_list: list of geometries (same order as in the tree)
-      geom_to_idx: dict mapping id(geom) -> index (needed for Shapely 1.x)
+    Vectorized _extract_points over an array of intersection results.
+    Returns (xy, src): an (n, 2) float array of points and the index into `inters` each came from,
+    in the same order _extract_points would yield them.
     """
-    geoms_list = list(geoms)
-    # Ensure object dtype for some builds
-    tree = STRtree(np.asarray(geoms_list, dtype=object))
-    geom_to_idx = {id(g): i for i, g in enumerate(geoms_list)}
-    return tree, geoms_list, geom_to_idx
-
-
-def _query_indices(tree: STRtree, geom_to_idx: Dict[int, int], gi):
+    # GeometryCollections (rare: mixed point/overlap results) go through the slow path
+    is_gc = shapely.get_type_id(inters) == 7
+    fast_idx = np.flatnonzero(~is_gc)
+
+    # Flatten Multi* in C; drop empties
+    parts, pidx = shapely.get_parts(inters[fast_idx], return_index=True)
+    nonempty = ~shapely.is_empty(parts)
+    parts, pidx = parts[nonempty], fast_idx[pidx[nonempty]]
+    ptype = shapely.get_type_id(parts)
+
+    # Points: the coordinate itself; lines/rings: first and last (once if closed)
+    is_pt = ptype == 0
+    is_ln = (ptype == 1) | (ptype == 2)
+    first = shapely.get_coordinates(shapely.get_point(parts[is_ln], 0))
+    last = shapely.get_coordinates(shapely.get_point(parts[is_ln], -1))
+    open_ln = ~np.all(first == last, axis=1)
+
+    # Order by (part, first/last) to match the per-geometry Python walk
+    part_no = np.arange(len(parts))
+    xy = np.concatenate([shapely.get_coordinates(parts[is_pt]), first, last[open_ln]])
+    order_key = np.concatenate([part_no[is_pt] * 2, part_no[is_ln] * 2, part_no[is_ln][open_ln] * 2 + 1])
+    order = np.argsort(order_key, kind="stable")
+    xy = xy[order]
+    src = np.concatenate([pidx[is_pt], pidx[is_ln], pidx[is_ln][open_ln]])[order]
+
+    gc_idx = np.flatnonzero(is_gc)
+    if len(gc_idx):
+        gc_pts = [_extract_points(inters[k]) for k in gc_idx]
+        gc_src = np.repeat(gc_idx, [len(pts) for pts in gc_pts])
+        if len(gc_src):
+            # one flat object array of Points -> (n, 2) coords in a single C call
+            xy = np.concatenate([xy, shapely.get_coordinates(np.fromiter(chain.from_iterable(gc_pts), dtype=object))])
+            src = np.concatenate([src, gc_src])
+            order = np.argsort(src, kind="stable")
+            xy, src = xy[order], src[order]
+
+    return xy.reshape(-1, 2), src.astype(np.int64)
+
+
+def _pair_intersection_points(
+    geoms_arr: np.ndarray, left: np.ndarray, right: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Intersection points of each (left[k], right[k]) pair as (xy, pair index), like _intersection_points
+    over shapely.intersection. LineString pairs that only touch at endpoints (DE-9IM 'FF*F0****') skip
+    the overlay: their shared endpoints are read straight from the coordinate arrays.
     """
-    Version-robust query:
-      - In Shapely 2.x, tree.query(gi) returns integer indices (ndarray).
-      - In Shapely 1.x, tree.query(gi) returns geometries; map them back to indices.
+    is_ls = (shapely.get_type_id(geoms_arr) == 1) & ~shapely.is_empty(geoms_arr)
+    ends = np.full((len(geoms_arr), 2, 2), np.nan)
+    ends[is_ls, 0] = shapely.get_coordinates(shapely.get_point(geoms_arr[is_ls], 0))
+    ends[is_ls, 1] = shapely.get_coordinates(shapely.get_point(geoms_arr[is_ls], -1))
+
+    # shared[k, e]: endpoint e of left[k] equals an endpoint of right[k]; only those pairs can touch
+    end_l, end_r = ends[left], ends[right]
+    shared = np.all(end_l[:, :, None, :] == end_r[:, None, :, :], axis=-1).any(axis=2)
+    touch = shared.any(axis=1) & is_ls[left] & is_ls[right]
+    cand = np.flatnonzero(touch)
+    touch[cand] = shapely.relate_pattern(geoms_arr[left[cand]], geoms_arr[right[cand]], "FF*F0****")
+
+    touch_idx = np.flatnonzero(touch)
+    touch_xy = end_l[touch_idx][shared[touch_idx]]
+    touch_src = np.repeat(touch_idx, shared[touch_idx].sum(axis=1))
+
+    # everything else (crossings, overlaps, multiparts) goes through the full intersection
+    rest = np.flatnonzero(~touch)
+    rest_xy, rest_src = _intersection_points(shapely.intersection(geoms_arr[left[rest]], geoms_arr[right[rest]]))
+
+    xy = np.concatenate([touch_xy, rest_xy])
+    src = np.concatenate([touch_src, rest[rest_src]])
+    order = np.argsort(src, kind="stable")
+    return xy[order], src[order]
+
+
+def _morton_keys(geoms_arr: np.ndarray) -> np.ndarray:
+    """Z-order (Morton) key of each geometry's bbox center on a 16-bit grid; empties sort last."""
+    b = shapely.bounds(geoms_arr)
+    return _morton_xy((b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2)
+
+
+def _morton_xy(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    """Z-order (Morton) key of each (x, y) on a 16-bit grid over their extent; NaNs sort last."""
+    valid = ~(np.isnan(cx) | np.isnan(cy))
+    keys = np.full(len(cx), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if not valid.any():
+        return keys
+
+    def quantize(v):
+        lo, hi = v.min(), v.max()
+        span = hi - lo if hi > lo else 1.0
+        return ((v - lo) / span * 0xFFFF).astype(np.uint64)
+
+    def spread(v):  # insert a zero bit between each of the 16 low bits
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+        v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+        return v
+
+    keys[valid] = spread(quantize(cx[valid])) | (spread(quantize(cy[valid])) << np.uint64(1))
+    return keys
+
+
+def _intersecting_pairs(geoms_arr: np.ndarray, engine: str = "strtree") -> Tuple[np.ndarray, np.ndarray]:
     """
-    try:
-        cand = tree.query(gi)  # prefer bbox filtering; exact test happens later
-        # If cand are geometries (Shapely 1.x), convert to indices via id()
-        arr = np.asarray(cand)
-        if arr.size > 0 and not np.issubdtype(arr.dtype, np.integer):
-            return [geom_to_idx[id(g)] for g in cand]
-        return list(map(int, cand))
-    except TypeError:
-        # Defensive: some older mixes raise TypeError but still return geometries
-        cand_geoms = tree.query(gi)
-        return [geom_to_idx[id(g)] for g in cand_geoms]
+    All (i, j) index pairs whose geometries intersect (includes i == j and both orders).
+    engine="rtree" uses a bulk-loaded libspatialindex R-tree for the bbox pass; falls back to STRtree
+    when rtree is not installed.
+    """
+    if engine == "rtree":
+        try:
+            from rtree import index
+        except ImportError:
+            engine = "strtree"
+
+    if engine != "rtree":
+        return STRtree(geoms_arr).query(geoms_arr, predicate="intersects")
+
+    bounds = shapely.bounds(geoms_arr)
+    valid = np.flatnonzero(~np.isnan(bounds).any(axis=1))  # empties have NaN bounds
+    idx = index.Index(((int(i), tuple(bounds[i]), None) for i in valid), properties=index.Property())
+    # bbox candidates for every geometry in one call, then the exact predicate vectorized
+    ids, counts = idx.intersection_v(bounds[valid, :2], bounds[valid, 2:])
+    left = np.repeat(valid, np.asarray(counts, dtype=np.int64))
+    right = np.asarray(ids, dtype=np.int64)
+    hit = shapely.intersects(geoms_arr[left], geoms_arr[right])
+    left, right = left[hit], right[hit]
+    order = np.lexsort((right, left))
+    return left[order], right[order]
+
+
+# Output format of nodes_table.parquet, stored in its schema metadata.
+# 2: interior intersections numbered by (edge i, edge j) instead of STRtree traversal order, so node_ids
+#    no longer depend on the spatial index. node_ids differ from format 1 files: regenerate
+#    nodes_table.parquet and anything keyed by node_id (saved routes, caches) together.
+# 3: node_ids assigned in Z-order of the node coordinates instead of first appearance; same caveat.
+NODES_FORMAT_VERSION = 3
 
 
 # ---------------------------
@@ -85,6 +200,7 @@ def build_nodes_intersections(
     tol_m: float = 5.0,
     ignore_grade_cols: Tuple[str, ...] = ("bridge", "tunnel", "layer"),
     include_geometry: bool = False,
+    engine: str = "strtree",
 ) -> pd.DataFrame | gpd.GeoDataFrame:
     """
     Compute intersection nodes (including endpoints and interior intersections) from a GeoDataFrame of edges.
@@ -101,11 +217,16 @@ def build_nodes_intersections(
         Column names used to avoid creating nodes at over/underpasses when they differ (grade-separated).
     include_geometry : bool
         If True, returns a GeoDataFrame with point geometry; else a plain DataFrame.
+    engine : str
+        Spatial index for the candidate-pair search: "strtree" (default) or "rtree" (libspatialindex;
+        falls back to STRtree if the rtree package is missing).
 
     Returns
     -------
     DataFrame or GeoDataFrame with columns:
         node_id (int), x (float), y (float), edges (List[edge_id]), [geometry (Point) if include_geometry]
+    node_id numbers nodes in Z-order (Morton) of their coordinates, so it does not depend on the row order
+    of `edges` and nearby nodes get nearby ids. `edges` is sorted by edge_id. (Format NODES_FORMAT_VERSION.)
     """
     assert edges.crs is not None, "Set a CRS on `edges` (e.g., 'EPSG:4326')."
 
@@ -116,102 +237,96 @@ def build_nodes_intersections(
     geoms_col = metric_edges.geometry
     if geoms_col is None:
         raise ValueError("`edges` must have a geometry column.")
-    eids = metric_edges[edge_id_col].to_numpy()
+    # Edge ids as sorted ordinals once; incident edges travel as int codes and map back at the end
+    edge_idx, edge_vals = pd.factorize(metric_edges[edge_id_col].to_numpy(), sort=True)
+    edge_idx = edge_idx.astype(np.int32)
 
     # Grade-separation key: different keys => skip intersections (likely over/underpasses)
-    def grade_key(row):
-        return "|".join(str(row.get(c, "")) for c in ignore_grade_cols)
-    grade = metric_edges.apply(grade_key, axis=1).to_numpy()
-
-    # STRtree + index mapping
-    tree, geoms_list, geom_to_idx = _make_tree_and_index(geoms_col)
-
-    raw_points: List[Point] = []
-    raw_incident: List[Set] = []
-
-    # 1) Collect endpoints (keeps dead-ends)
-    for eid, g in zip(eids, geoms_list):
-        if g.is_empty:
+    # (one int64 per edge: per-column factorize codes packed mixed-radix; missing columns count as constant)
+    grade = np.zeros(len(metric_edges), dtype=np.int64)
+    for c in ignore_grade_cols:
+        if c not in metric_edges.columns:
             continue
-        if g.geom_type == "LineString":
-            coords = list(g.coords)
-            if not coords:
-                continue
-            endpoints = [Point(coords[0]), Point(coords[-1])]
-        elif g.geom_type == "MultiLineString":
-            # Use first/last of outer parts for endpoints
-            first = list(g.geoms[0].coords)[0]
-            last = list(g.geoms[-1].coords)[-1]
-            endpoints = [Point(first), Point(last)]
-        else:
-            continue
-        for p in endpoints:
-            raw_points.append(p)
-            raw_incident.append({eid})
-
-    # 2) Interior intersections (pairwise)
-    n = len(geoms_list)
-    for i in range(n):
-        gi = geoms_list[i]
-        if gi.is_empty:
-            continue
-
-        cand_idx = _query_indices(tree, geom_to_idx, gi)
-        for j in cand_idx:
-            if j <= i:
-                continue
-            gj = geoms_list[j]
-
-            # Skip likely grade-separated crossings
-            if grade[i] != grade[j]:
-                continue
-
-            # Exact test (avoid bbox-only matches)
-            if not gi.intersects(gj):
-                continue
-
-            inter = gi.intersection(gj)
-            if inter.is_empty:
-                continue
-
-            pts = _extract_points(inter)
-            if not pts:
-                continue
-
-            ei, ej = eids[i], eids[j]
-            for p in pts:
-                raw_points.append(p)
-                raw_incident.append({ei, ej})
+        codes, uniques = pd.factorize(metric_edges[c].astype(str))
+        grade = grade * (len(uniques) + 1) + (codes + 1)
+
+    geoms_arr = np.asarray(geoms_col.values, dtype=object)
+
+    # 1) Collect endpoints (keeps dead-ends): first/last coordinate of every non-empty (Multi)LineString
+    #    in one vectorized pass; for MultiLineStrings that is the first/last of the outer parts.
+    is_line = np.isin(shapely.get_type_id(geoms_arr), (1, 5)) & ~shapely.is_empty(geoms_arr)
+    line_idx = np.flatnonzero(is_line)
+    coords, idx = shapely.get_coordinates(geoms_arr[line_idx], return_index=True)
+    uniq, firsts = np.unique(idx, return_index=True)
+    lasts = np.searchsorted(idx, uniq, side="right") - 1
+    # interleave (first, last) per edge; parallel array of incident edge codes (SoA)
+    end_xy = np.stack([coords[firsts], coords[lasts]], axis=1).reshape(-1, 2)
+    end_edge = np.repeat(edge_idx[line_idx], 2)
+
+    # 2) Interior intersections: all intersecting pairs from one bulk STRtree query (exact predicate,
+    #    empty geometries never match), each unordered pair once, same-grade pairs only
+    #    Geometries are Z-ordered first so neighbouring pairs (and their GEOS coords) stay close in memory
+    perm = np.argsort(_morton_keys(geoms_arr), kind="stable")
+    geoms_z = geoms_arr[perm]
+    left, right = _intersecting_pairs(geoms_z, engine)
+    keep = right > left
+    left, right = left[keep], right[keep]
+    # Skip likely grade-separated crossings
+    keep = grade[perm[left]] == grade[perm[right]]
+    left, right = left[keep], right[keep]
+
+    inter_xy, inter_pair = _pair_intersection_points(geoms_z, left, right)
+    # back to input row numbers, each pair as (lower, higher)
+    left, right = np.minimum(perm[left], perm[right]), np.maximum(perm[left], perm[right])
+    # Fix the point order independently of the tree layout and of intersection(a, b) vs intersection(b, a),
+    # by (edge i, edge j, x, y), so the per-cell coordinate sums below are reproducible bit for bit
+    pt_order = np.lexsort((inter_xy[:, 1], inter_xy[:, 0], right[inter_pair], left[inter_pair]))
+    inter_xy, inter_pair = inter_xy[pt_order], inter_pair[pt_order]
 
     # 3) Snap/cluster points to tol_m via grid quantization
-    if len(raw_points) == 0:
+    if len(end_xy) + len(inter_xy) == 0:
         # No intersections; return empty structure
         cols = ["node_id", "x", "y", "edges"]
         return gpd.GeoDataFrame(columns=(cols + ["geometry"]), crs=metric_edges.crs) if include_geometry else pd.DataFrame(columns=cols)
 
     gsize = float(tol_m)
-    xs = np.fromiter((p.x for p in raw_points), dtype=float)
-    ys = np.fromiter((p.y for p in raw_points), dtype=float)
+    xs = np.concatenate([end_xy[:, 0], inter_xy[:, 0]])
+    ys = np.concatenate([end_xy[:, 1], inter_xy[:, 1]])
     qx = np.round(xs / gsize).astype(np.int64)
     qy = np.round(ys / gsize).astype(np.int64)
 
-    bins: Dict[Tuple[int, int], Dict[str, list | set]] = {}
-    for ix, iy, x, y, inc in zip(qx, qy, xs, ys, raw_incident):
-        key = (ix, iy)
-        if key not in bins:
-            bins[key] = {"xs": [x], "ys": [y], "edges": set(inc)}
-        else:
-            bins[key]["xs"].append(x)
-            bins[key]["ys"].append(y)
-            bins[key]["edges"].update(inc)
-
-    node_records = []
-    for payload in bins.values():
-        xs_bin, ys_bin, inc = payload["xs"], payload["ys"], payload["edges"]
-        cx, cy = float(np.mean(xs_bin)), float(np.mean(ys_bin))
-        node_records.append({"geometry": Point(cx, cy), "edges": sorted(inc)})
-
-    nodes_gdf = gpd.GeoDataFrame(node_records, crs=metric_edges.crs)
+    # Sort-based groupby on one packed int64 key per grid cell
+    key = (qx << 32) | (qy & 0xFFFFFFFF)
+    order = np.argsort(key, kind="stable")
+    sk = key[order]
+    is_start = np.concatenate([[True], sk[1:] != sk[:-1]])
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(sk)))
+    cx = np.add.reduceat(xs[order], starts) / counts
+    cy = np.add.reduceat(ys[order], starts) / counts
+
+    # Number bins in Z-order of their centers (ties by grid cell), so nearby nodes get nearby node_ids
+    z_order = np.lexsort((sk[starts], _morton_xy(cx, cy)))
+    rank = np.empty(len(starts), dtype=np.int64)
+    rank[z_order] = np.arange(len(starts))
+    bin_of_point = np.empty(len(sk), dtype=np.int64)
+    bin_of_point[order] = rank[np.cumsum(is_start) - 1]
+    cx, cy = cx[z_order], cy[z_order]
+
+    # Incident edges as CSR-style (point_row, edge_col) triplets: one row per endpoint,
+    # two per intersection point (one for each edge of the pair)
+    n_end = len(end_edge)
+    point_row = np.concatenate([
+        np.arange(n_end, dtype=np.int32),
+        np.repeat(np.arange(n_end, len(xs), dtype=np.int32), 2),
+    ])
+    edge_col = np.concatenate([end_edge, np.stack([edge_idx[left[inter_pair]], edge_idx[right[inter_pair]]], axis=1).ravel()])
+    n_e = len(edge_vals)
+    be = np.unique(bin_of_point[point_row] * n_e + edge_col)
+    be_bin, be_edge = be // n_e, edge_vals.take(be % n_e)
+    edge_lists = [a.tolist() for a in np.split(np.asarray(be_edge), np.flatnonzero(np.diff(be_bin)) + 1)]
+
+    nodes_gdf = gpd.GeoDataFrame({"edges": edge_lists}, geometry=gpd.points_from_xy(cx, cy), crs=metric_edges.crs)
     nodes_gdf.insert(0, "node_id", np.arange(1, len(nodes_gdf) + 1, dtype=np.int64))
     nodes_gdf["x"] = nodes_gdf.geometry.x
     nodes_gdf["y"] = nodes_gdf.geometry.y
@@ -245,6 +360,7 @@ def build_nodes_intersections_from_df(
     tol_m: float = 5.0,
     ignore_grade_cols: Tuple[str, ...] = ("bridge", "tunnel", "layer"),
     include_geometry: bool = False,
+    engine: str = "strtree",
 ) -> pd.DataFrame | gpd.GeoDataFrame:
     """
     Accepts a plain pandas DataFrame with columns:
@@ -252,18 +368,17 @@ def build_nodes_intersections_from_df(
     Builds a GeoDataFrame of LineStrings in EPSG:4326, computes intersections,
     and returns the nodes table.
     """
-    # Construct LineStrings from endpoints
-    lines = [
-        LineString([(float(sl), float(sa)), (float(el), float(ea))])
-        for sl, sa, el, ea in zip(
-            edges_df[start_lon_col].to_numpy(),
-            edges_df[start_lat_col].to_numpy(),
-            edges_df[end_lon_col].to_numpy(),
-            edges_df[end_lat_col].to_numpy(),
-        )
-    ]
-
-    gdf = gpd.GeoDataFrame(edges_df.copy(), geometry=lines, crs="EPSG:4326")
+    # Construct LineStrings from endpoints in one bulk call: (n, 2 points, lon/lat)
+    n = len(edges_df)
+    pts = np.empty((n, 2, 2), dtype=np.float64)
+    pts[:, 0, 0] = edges_df[start_lon_col].to_numpy(dtype=np.float64)
+    pts[:, 0, 1] = edges_df[start_lat_col].to_numpy(dtype=np.float64)
+    pts[:, 1, 0] = edges_df[end_lon_col].to_numpy(dtype=np.float64)
+    pts[:, 1, 1] = edges_df[end_lat_col].to_numpy(dtype=np.float64)
+    lines = shapely.linestrings(pts)
+
+    # GeoDataFrame only wraps edges_df here; the caller's frame is left untouched
+    gdf = gpd.GeoDataFrame(edges_df, geometry=lines, crs="EPSG:4326")
 
     return build_nodes_intersections(
         gdf,
@@ -271,6 +386,7 @@ def build_nodes_intersections_from_df(
         tol_m=tol_m,
         ignore_grade_cols=ignore_grade_cols,
         include_geometry=include_geometry,
+        engine=engine,
     )
 
 
@@ -296,8 +412,12 @@ if __name__ == "__main__":
     out_path = "../../data/data_backend/nodes_table.parquet"
 
     if isinstance(nodes, gpd.GeoDataFrame):
+        # let geopandas write its geo metadata, then stamp the format version next to it
         nodes.to_parquet(out_path, index=False)
+        table = pq.read_table(out_path)
     else:
-        pd.DataFrame(nodes).to_parquet(out_path, index=False)
+        table = pa.Table.from_pandas(pd.DataFrame(nodes), preserve_index=False)
+    meta = (table.schema.metadata or {}) | {b"nodes_format_version": str(NODES_FORMAT_VERSION).encode()}
+    pq.write_table(table.replace_schema_metadata(meta), out_path)
 
     print(f"Saved {len(nodes)} nodes to {out_path}")
\ No newline at end of file
@@ -0,0 +1,54 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import LineString, MultiLineString
+
+import node_table
+
+
+def _edges():
+    rng = np.random.default_rng(7)
+    geoms = []
+    for i in range(200):
+        p = rng.integers(0, 20, size=(rng.integers(2, 5), 2)).astype(float) * 10
+        if i % 17 == 0:
+            geoms.append(MultiLineString([p[:2], p[::-1] + 5]))
+        elif i % 23 == 0:
+            geoms.append(LineString(np.vstack([p, p[:1]])))
+        else:
+            geoms.append(LineString(p))
+    geoms.append(LineString([(0, 0), (100, 0)]))
+    geoms.append(LineString([(50, 0), (150, 0)]))  # collinear overlap: multipoint/line intersections
+    return gpd.GeoDataFrame({"edge_id": np.arange(len(geoms))}, geometry=geoms, crs="EPSG:32618")
+
+
+def _as_rows(nodes):
+    return [(int(i), round(x, 6), round(y, 6), tuple(es)) for i, x, y, es in zip(nodes.node_id, nodes.x, nodes.y, nodes.edges)]
+
+
+def test_node_ids_do_not_depend_on_tree_layout(monkeypatch):
+    edges = _edges()
+    expected = _as_rows(node_table.build_nodes_intersections(edges, tol_m=5.0, include_geometry=False))
+    assert len(expected) > 0
+
+    # Different geometry permutations give different STRtree layouts, pair orders and pair orientations
+    for seed in (0, 1):
+        keys = np.random.default_rng(seed).permutation(len(edges)).astype(np.uint64)
+        monkeypatch.setattr(node_table, "_morton_keys", lambda geoms_arr, keys=keys: keys)
+        got = _as_rows(node_table.build_nodes_intersections(edges, tol_m=5.0, include_geometry=False))
+        assert got == expected
+
+
+
+def test_node_ids_do_not_depend_on_row_order():
+    edges = _edges()
+    expected = _as_rows(node_table.build_nodes_intersections(edges, tol_m=5.0, include_geometry=False))
+    shuffled = edges.sample(frac=1, random_state=3).reset_index(drop=True)
+    got = _as_rows(node_table.build_nodes_intersections(shuffled, tol_m=5.0, include_geometry=False))
+    assert got == expected
+
+
+def test_node_ids_follow_z_order():
+    nodes = node_table.build_nodes_intersections(_edges(), tol_m=5.0, include_geometry=False)
+    keys = node_table._morton_xy(nodes.x.to_numpy(), nodes.y.to_numpy())
+    assert list(nodes.node_id) == list(range(1, len(nodes) + 1))
+    assert (np.diff(keys.astype(np.int64)) >= 0).all()
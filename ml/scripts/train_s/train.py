@@ -4,7 +4,6 @@ import gc
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import GroupShuffleSplit
 import lightgbm as lgb
 from torch.utils.tensorboard import SummaryWriter
 from pathlib import Path
@@ -93,25 +92,54 @@ def make_checkpoint_callback(out_dir: str,
     return _callback
 
 
+# With the built-in "binary" objective LightGBM already hands fevals probabilities (not raw scores),
+# so the metrics below use y_pred directly; no per-round sigmoid.
+
+_pr_sample_cache = {}
+
+def _pr_sample(y):
+    """
+    Fixed label-stratified subsample of eval rows for PR-curve threshold searches
+    (None if the eval set is already small). Drawn once, reused every round.
+    """
+    n = len(y)
+    if n <= PR_EVAL_SAMPLE:
+        return None
+    key = (n, int(y.sum()))
+    if key not in _pr_sample_cache:
+        rng = np.random.default_rng(RANDOM_STATE)
+        frac = PR_EVAL_SAMPLE / n
+        parts = []
+        for c in (0, 1):
+            rows = np.flatnonzero(y == c)
+            parts.append(rng.choice(rows, size=int(round(frac * len(rows))), replace=False))
+        _pr_sample_cache[key] = np.sort(np.concatenate(parts))
+    return _pr_sample_cache[key]
+
+def _pr_curve(y, p):
+    sub = _pr_sample(y)
+    if sub is None:
+        return precision_recall_curve(y, p)
+    return precision_recall_curve(y[sub], p[sub])
+
 def pr_auc_eval(y_pred, dset):
     y = dset.get_label()
-    p = 1.0/(1.0+np.exp(-y_pred))
-    return "pr_auc", float(average_precision_score(y, p)), True  # higher better
+    return "pr_auc", float(average_precision_score(y, y_pred)), True  # higher better
 
 def balanced_accuracy_eval(y_pred, dset):
     y = dset.get_label()
-    p = 1.0/(1.0+np.exp(-y_pred))
+    p = y_pred
     yhat = (p >= 0.5).astype(np.uint8)
-    tn = ((y==0)&(yhat==0)).sum(); tp = ((y==1)&(yhat==1)).sum()
-    fn = ((y==1)&(yhat==0)).sum(); fp = ((y==0)&(yhat==1)).sum()
+    # one histogram over the packed (label, prediction) code: 0=tn, 1=fp, 2=fn, 3=tp
+    tn, fp, fn, tp = np.bincount((y.astype(np.uint8) << 1) | yhat, minlength=4)
     tpr = tp / max(tp+fn, 1); tnr = tn / max(tn+fp, 1)
     bacc = 0.5*(tpr+tnr)
     return "balanced_acc@0.5", float(bacc), True
 
 def acc_at_best_f1_eval(y_pred, dset):
     y = dset.get_label()
-    p = 1.0/(1.0+np.exp(-y_pred))
-    prec, rec, thr = precision_recall_curve(y, p)
+    p = y_pred
+    prec, rec, thr = _pr_curve(y, p)   # threshold picked on the subsample, accuracy on all rows
     f1 = 2*prec*rec/(prec+rec+1e-15)
     i = int(np.nanargmax(f1))
     thr_best = 0.5 if i==0 else float(thr[i-1])
@@ -121,8 +149,8 @@ def acc_at_best_f1_eval(y_pred, dset):
 
 def acc_at_p90_eval(y_pred, dset, target_p=0.90):
     y = dset.get_label()
-    p = 1.0/(1.0+np.exp(-y_pred))
-    prec, rec, thr = precision_recall_curve(y, p)
+    p = y_pred
+    prec, rec, thr = _pr_curve(y, p)
     # find highest threshold with precision >= target_p
     idx = np.where(prec[:-1] >= target_p)[0]
     thr_use = 1.0 if len(idx)==0 else float(thr[idx[-1]])
@@ -132,8 +160,8 @@ def acc_at_p90_eval(y_pred, dset, target_p=0.90):
 
 def brier_eval(y_pred, dset):
     y = dset.get_label()
-    p = 1.0/(1.0+np.exp(-y_pred))
-    brier = np.mean((p - y)**2)
+    d = y_pred - y   # one temporary; y_pred itself is shared with the other fevals
+    brier = np.dot(d, d) / len(d)
     return "brier", float(brier), False  # lower better
 
 TENSORBOARD_DIR = "../tensorboard_logs"
@@ -153,6 +181,7 @@ RANDOM_STATE = 42
 N_BOOST_ROUND = 5000
 EARLY_STOP_ROUNDS = 200
 N_THREADS = os.cpu_count() or 8
+PR_EVAL_SAMPLE = 200_000  # max valid rows used for per-round PR-curve threshold searches
 
 FEATURES = [
     "lat_sin", "lat_cos", "lon_sin", "lon_cos",
@@ -176,26 +205,34 @@ missing = required_cols - set(df.columns)
 if missing:
     raise ValueError(f"Missing columns: {missing}")
 
-# Ensure numeric types + guard against infs
-df[FEATURES] = df[FEATURES].astype(np.float32)
-df[LABEL] = df[LABEL].astype(np.uint8)
-df[FEATURES] = df[FEATURES].replace([np.inf, -np.inf], np.nan)
-
 # ----------------------------
 # Group-aware split (by cluster_id)
 # ----------------------------
+# Whole clusters go to validation (as GroupShuffleSplit would); rows are picked with a boolean mask
+# and copied column by column straight into preallocated float32 matrices (no train/valid DataFrames).
 print("Splitting by groups (cluster_id)...")
-gss = GroupShuffleSplit(n_splits=1, test_size=VALID_FRACTION, random_state=RANDOM_STATE)
-groups = df[GROUP].values
-train_idx, valid_idx = next(gss.split(df[FEATURES], df[LABEL], groups=groups))
-train_df = df.iloc[train_idx]
-valid_df = df.iloc[valid_idx]
-del df; gc.collect()
-
-X_train = train_df[FEATURES]
-y_train = train_df[LABEL].values
-X_valid = valid_df[FEATURES]
-y_valid = valid_df[LABEL].values
+group_codes, group_values = pd.factorize(df[GROUP])
+n_valid_groups = int(np.ceil(VALID_FRACTION * len(group_values)))
+rng = np.random.default_rng(RANDOM_STATE)
+is_valid_group = np.zeros(len(group_values), dtype=bool)
+is_valid_group[rng.choice(len(group_values), size=n_valid_groups, replace=False)] = True
+valid_mask = is_valid_group[group_codes]
+train_mask = ~valid_mask
+del group_codes
+
+X_train = np.empty((int(train_mask.sum()), len(FEATURES)), dtype=np.float32, order="F")
+X_valid = np.empty((int(valid_mask.sum()), len(FEATURES)), dtype=np.float32, order="F")
+for i, f in enumerate(FEATURES):
+    col = df[f].to_numpy(dtype=np.float32)
+    np.compress(train_mask, col, out=X_train[:, i])
+    np.compress(valid_mask, col, out=X_valid[:, i])
+y_train = df[LABEL].to_numpy(dtype=np.uint8)[train_mask]
+y_valid = df[LABEL].to_numpy(dtype=np.uint8)[valid_mask]
+del df, col; gc.collect()
+
+# Guard against infs
+X_train[~np.isfinite(X_train)] = np.nan
+X_valid[~np.isfinite(X_valid)] = np.nan
 
 # ----------------------------
 # LightGBM datasets
@@ -205,9 +242,6 @@ TENSORBOARD_DIR = "../tensorboard_logs"
 
 # ... (load/split data exactly as you already do; keep pandas/NumPy) ...
 
-train_set = lgb.Dataset(X_train, label=y_train, feature_name=FEATURES, free_raw_data=False)
-valid_set = lgb.Dataset(X_valid, label=y_valid, feature_name=FEATURES, reference=train_set, free_raw_data=False)
-
 pos = float(y_train.sum())
 neg = float(len(y_train) - y_train.sum())
 scale_pos_weight = float(max(1.0, neg / max(pos, 1.0)))
@@ -244,6 +278,14 @@ params = {
     "max_bin": 63,                # faster for GPU
 }
 
+# Bin once with the training params (max_bin etc.), then drop the raw float matrices:
+# only the binned data (~4x smaller) is needed for training; fevals read labels only.
+train_set = lgb.Dataset(X_train, label=y_train, feature_name=FEATURES, params=params, free_raw_data=True)
+valid_set = lgb.Dataset(X_valid, label=y_valid, feature_name=FEATURES, reference=train_set, params=params, free_raw_data=True)
+train_set.construct()
+valid_set.construct()
+del X_train, X_valid; gc.collect()
+
 writer = SummaryWriter(log_dir=TENSORBOARD_DIR)
 tb_cb = make_tb_callback(writer, log_train=False)
 
@@ -1,8 +1,9 @@
 from __future__ import annotations
-from typing import Optional, List
+from typing import Optional, List, Iterable, Tuple
 
-from sqlalchemy import create_engine, Integer, Text, select, delete, func,DateTime
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
+from sqlalchemy import create_engine, event, make_url, insert, Integer, Text, select, delete, func,DateTime
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session, aliased
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
@@ -28,12 +29,38 @@ class Chat(Base):
 def init_db(db_url: str = "sqlite:///chat_history.db"):
     """
     Create tables (if missing) and return an Engine.
+    SQLite connections run in WAL mode with synchronous=NORMAL (no fsync per commit, still crash-safe).
     """
-    engine = create_engine(db_url, future=True)
+    engine = create_engine(db_url, future=True, echo=False, **_pool_options(db_url))
+    _enable_sqlite_wal(engine)
     Base.metadata.create_all(engine)
     return engine
 
 
+def _pool_options(db_url: str) -> dict:
+    """
+    Connection pool settings shared by the sync and async engines: keep up to 20 (+10 burst) connections open,
+    check them with a ping before use and recycle them every 30 min. Check with engine.pool.status().
+    In-memory SQLite uses a single static connection, so it gets no pool options.
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {"pool_size": 20, "max_overflow": 10, "pool_timeout": 30, "pool_pre_ping": True, "pool_recycle": 1800}
+
+
+def _enable_sqlite_wal(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+
 def get_session(engine) -> Session:
     """
     Create a new SQLAlchemy Session bound to the engine.
@@ -43,7 +70,7 @@ def get_session(engine) -> Session:
 
 def add_message(session: Session, sender: int, text: str, timestamp: datetime | None = None, limit: int = 20) -> Chat:
     """
-    Insert a message. If total count exceeds `limit`, delete the oldest extras.
+    Insert a message. If more than `limit` rows remain, delete the oldest extras.
     Returns the inserted Chat row. <-- NOW CORRECTLY RETURNS
     """
     # Insert
@@ -55,22 +82,44 @@ def add_message(session: Session, sender: int, text: str, timestamp: datetime |
     session.add(msg)
     session.flush()  # assigns row.id without committing
 
-    # Enforce cap (logic unchanged, kept for brevity)
-    count = session.execute(select(func.count()).select_from(Chat)).scalar_one()
-    if count > limit:
-        to_delete = count - limit
-        del_stmt = delete(Chat).where(
-            Chat.id.in_(
-                select(Chat.id).order_by(Chat.id.asc()).limit(to_delete)
-            )
-        )
-        session.execute(del_stmt)
+    _enforce_cap(session, limit)
 
     session.commit()
     session.refresh(msg)
     return msg # <-- CRITICAL FIX: Return the newly created message object
 
 
+def add_messages(session: Session, items: Iterable[Tuple[int, str]], timestamp: datetime | None = None, limit: int = 20) -> int:
+    """
+    Bulk insert (sender, text) pairs in one executemany and a single commit, then apply the cap once.
+    Meant for imports/migrations; returns the number of rows inserted.
+    """
+    if timestamp is None:
+        timestamp = datetime.now(ZoneInfo("America/New_York"))
+
+    rows = [{"sender": sender, "message": text, "timestamp": timestamp} for sender, text in items]
+    if not rows:
+        return 0
+
+    session.execute(insert(Chat), rows)
+    _enforce_cap(session, limit)
+    session.commit()
+    return len(rows)
+
+
+def _enforce_cap(session: Session, limit: int):
+    """
+    Drop everything at or below the (limit+1)-th newest id.
+    One PK-indexed DELETE, no COUNT; the subquery is NULL (nothing deleted) while under the cap.
+    """
+    session.execute(_cap_stmt(limit))
+
+
+def _cap_stmt(limit: int):
+    cutoff = select(Chat.id).order_by(Chat.id.desc()).offset(limit).limit(1).scalar_subquery()
+    return delete(Chat).where(Chat.id <= cutoff)
+
+
 def get_last_message(session: Session) -> Optional[Chat]:
     """
     Return the most recent Chat row or None.
@@ -105,12 +154,15 @@ def recreate_chat_table(engine):
 
 
 def get_recent_rows(session: Session, n=20) -> List[Chat]:
-
-    rows = list(session.execute(
-        select(Chat).order_by(Chat.id.desc()).limit(n)
+    """
+    Return the last `n` Chat rows in chronological order.
+    The newest-n window is a subquery; SQLite re-sorts it ascending, so no Python-side reverse.
+    """
+    recent = select(Chat).order_by(Chat.id.desc()).limit(n).subquery()
+    recent_chat = aliased(Chat, recent)
+    return list(session.execute(
+        select(recent_chat).order_by(recent.c.id.asc())
     ).scalars().all())
-    rows.reverse()
-    return rows
 
 
 def message_history(session: Session, n=20, system_prompt: str | None = None) -> List[dict]:
@@ -124,6 +176,73 @@ def message_history(session: Session, n=20, system_prompt: str | None = None) ->
     return msgs
 
 
+# ---------- async API (used by the FastAPI app) ----------
+def init_async_db(db_url: str = "sqlite+aiosqlite:///chat_history.db") -> AsyncEngine:
+    """
+    Return an AsyncEngine (aiosqlite / asyncpg driver URL). Tables are created by create_tables_async,
+    which has to run inside the event loop (e.g. app startup).
+    """
+    engine = create_async_engine(db_url, echo=False, **_pool_options(db_url))
+    _enable_sqlite_wal(engine.sync_engine)
+    return engine
+
+
+async def create_tables_async(engine: AsyncEngine):
+    """
+    Create tables (if missing) on the async engine.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def get_async_sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    """
+    Session factory for the async engine. Rows stay readable after commit (no lazy reload on access).
+    """
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def add_message_async(session: AsyncSession, sender: int, text: str, timestamp: datetime | None = None, limit: int = 20) -> Chat:
+    """
+    Async add_message: insert, enforce the `limit` cap, commit, return the inserted row.
+    """
+    if timestamp is None:
+        timestamp = datetime.now(ZoneInfo("America/New_York"))
+
+    msg = Chat(sender=sender, message=text, timestamp=timestamp)
+    session.add(msg)
+    await session.flush()
+    await session.execute(_cap_stmt(limit))
+    await session.commit()
+    await session.refresh(msg)
+    return msg
+
+
+async def get_all_messages_async(session: AsyncSession) -> List[Chat]:
+    """
+    Async get_all_messages: all Chat rows in chronological order.
+    """
+    return list((await session.execute(select(Chat).order_by(Chat.id.asc()))).scalars().all())
+
+
+async def get_recent_messages_async(session: AsyncSession, limit: int = 32) -> List[Chat]:
+    """
+    Async: the last `limit` non-empty Chat rows in chronological order (Gemini context window).
+    Same newest-n subquery as get_recent_rows, so the fetch is O(limit) however big the table gets.
+    """
+    recent = (
+        select(Chat)
+        .where(Chat.message.is_not(None))
+        .order_by(Chat.id.desc())
+        .limit(limit)
+        .subquery()
+    )
+    recent_chat = aliased(Chat, recent)
+    return list((await session.execute(
+        select(recent_chat).order_by(recent.c.id.asc())
+    )).scalars().all())
+
+
 if __name__ == "__main__":
     engine = init_db()
     # recreate_chat_table(engine)  #UNCOMMIT IF YOU WANT TO RECREATE A DB
\ No newline at end of file
@@ -1,7 +1,7 @@
 # gemini.py (FINAL CLEAN CODE)
 import os
 from google.genai import Client, types
-from typing import List
+from typing import AsyncIterator, List
 import logging
 
 # Set up logging for better backend debugging
@@ -32,52 +32,48 @@ SYSTEM_INSTRUCTION = (
 )
 
 
-def get_gemini_response(db_messages: List) -> str:
+def _to_content(msg) -> types.Content:
+    role = "user" if msg.sender == 0 else "model"
+    return types.Content(
+        role=role,
+        parts=[types.Part(text=msg.message.strip())]
+    )
+
+
+async def astream_gemini_response(db_messages: List) -> AsyncIterator[str]:
     """
-    Generates a response from the Gemini model based on the chat history.
+    Streams a response from the Gemini model based on the chat history, yielding text chunks
+    as they arrive (first token instead of full-completion latency). Uses the SDK's aio client,
+    so the event loop (not a threadpool worker) waits on the model between chunks.
     """
     if not client:
         raise Exception("AI service is unavailable: Gemini client not configured or API key missing.")
 
     if len(db_messages) == 0:
-        return "Hello! How can I help you with safer routes?"
+        yield "Hello! How can I help you with safer routes?"
+        return
 
-    # Build history (all but last)
-    history = []
-    for msg in db_messages[:-1]:
-        role = "user" if msg.sender == 0 else "model"
-        message_text = msg.message.strip()
-        history.append(
-            types.Content(
-                role=role,
-                parts=[types.Part(text=message_text)]
-            )
-        )
-
-    # Validate + add final user turn
+    # Validate final user turn
     last_message = db_messages[-1]
     if last_message.sender != 0:
         logger.warning(f"Last message (ID: {last_message.id}) in history is not from user. Aborting chat response.")
-        return "Internal error: Expected user message to be the last one in the queue."
+        yield "Internal error: Expected user message to be the last one in the queue."
+        return
 
-    history.append(
-        types.Content(
-            role="user",
-            parts=[types.Part(text=last_message.message.strip())]
-        )
-    )
+    # Build history
+    history = [_to_content(msg) for msg in db_messages]
 
-    # Call the Models API (supports system_instruction)
     try:
-        resp = client.models.generate_content(
+        stream = await client.aio.models.generate_content_stream(
             model="gemini-2.5-flash",
             config=types.GenerateContentConfig(
                 system_instruction=SYSTEM_INSTRUCTION),
             contents=history,
         )
-        # .text is the common convenience property; fall back if needed
-        text = getattr(resp, "text", None) or getattr(resp, "output_text", None) or ""
-        return text.strip() or "Sorry—got an empty reply."
+        async for chunk in stream:
+            text = getattr(chunk, "text", None)
+            if text:
+                yield text
     except Exception as e:
         logger.error(f"Gemini API call failed: {e}")
-        raise
\ No newline at end of file
+        raise
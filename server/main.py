@@ -1,29 +1,69 @@
 # main.py (FULL FIXED)
 from fastapi import FastAPI, Depends, HTTPException, Response, status, Request
+from collections import OrderedDict
 from functools import lru_cache
+import asyncio
+import gzip
+import hashlib
 import os
+import time
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow.parquet as pq
 from fastapi.middleware.cors import CORSMiddleware
 import a_star_v2
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 # Assuming database_s.py and Chat model are correctly implemented
-from database_s import init_db, get_session, add_message, get_all_messages
-from typing import List, Optional
+from database_s import init_async_db, create_tables_async, get_async_sessionmaker, add_message_async, get_all_messages_async, get_recent_messages_async
+from typing import Any, Dict, List, Optional
 from zoneinfo import ZoneInfo
 from datetime import datetime
-from sqlalchemy.orm import Session
-from gemini import get_gemini_response
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from gemini import astream_gemini_response
 
-app = FastAPI(title="SafeStreets")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_tables_async(engine)
+    yield
+    await engine.dispose()
+
+
+app = FastAPI(title="SafeStreets", lifespan=lifespan)
 
 EDGES_PATH = "../ml/data/data_backend/edges_table.parquet"
+NODES_PATH = "../ml/data/data_backend/nodes_table.parquet"
+
+# Edge columns served by /heatmap
+HEATMAP_COLUMNS = ["start_lat", "start_lon", "end_lat", "end_lon", "risk_score"]
+# Heatmap precision: 1e-6 deg is ~0.1 m; risk in steps of 1e-4 (the resolution of an int16 scaled by 10^4)
+HEATMAP_COORD_DECIMALS = 6
+HEATMAP_RISK_DECIMALS = 4
+
+
+def _read_table(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return pq.read_table(path, columns=columns, use_threads=True).to_pandas()
+
+
+# Loaded once per process; /heatmap and /route only read these
 try:
-    edges_df = pd.read_parquet(EDGES_PATH)
+    # Full table: a_star_v2 may read any edge column; the heatmap only takes HEATMAP_COLUMNS from it
+    edges_df = _read_table(EDGES_PATH)
 except Exception as e:
     print(f"WARNING: Could not load edges_df from {EDGES_PATH}. Error: {e}")
     edges_df = pd.DataFrame()
 
+# Heatmap edges as parallel column arrays (SoA), taken once; the payload path never touches pandas
+heat_columns = {c: edges_df[c].to_numpy() for c in HEATMAP_COLUMNS} if not edges_df.empty else {}
+
+try:
+    nodes_df = _read_table(NODES_PATH)
+except Exception as e:
+    print(f"WARNING: Could not load nodes_df from {NODES_PATH}. Error: {e}")
+    nodes_df = pd.DataFrame()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,36 +74,61 @@ app.add_middleware(
 
 
 class RouteIn(BaseModel):
-    from_: list[float] = Field(alias="from", min_items=2, max_items=2)
-    to: list[float] = Field(min_items=2, max_items=2)
+    from_: list[float] = Field(alias="from", min_length=2, max_length=2)
+    to: list[float] = Field(min_length=2, max_length=2)
+
+
+# Declared response models let FastAPI serialize straight to JSON bytes with pydantic-core
+class RouteOut(BaseModel):
+    path: Any
 
 
 def _build_payload():
-    results = []
-    if edges_df.empty:
+    if not heat_columns:
         return []
 
-    for _, row in edges_df.iterrows():
-        results.append({"from": [row["start_lat"], row["start_lon"]], "to": [row["end_lat"], row["end_lon"]],
-                        "risk_score": row["risk_score"]})
-    return results
+    # Column arrays -> Python floats in C (tolist), then one zip; no per-row Series.
+    # Values are rounded first so orjson emits short literals instead of 17 significant digits.
+    lat1, lon1, lat2, lon2 = (np.round(heat_columns[c], HEATMAP_COORD_DECIMALS).tolist() for c in HEATMAP_COLUMNS[:4])
+    risk = np.round(heat_columns["risk_score"], HEATMAP_RISK_DECIMALS).tolist()
+    return [{"from": [a, b], "to": [c, d], "risk_score": r} for a, b, c, d, r in zip(lat1, lon1, lat2, lon2, risk)]
 
 
+# edges_df is static for the process lifetime, so cache the serialized JSON (and a gzipped copy),
+# not the Python list: cached hits skip the per-request encode entirely.
 @lru_cache(maxsize=1)
-def _cached_payload():
-    df = pd.read_parquet(EDGES_PATH)
-    return _build_payload()
+def _cached_payload_bytes() -> bytes:
+    return orjson.dumps(_build_payload())
+
+
+@lru_cache(maxsize=1)
+def _cached_payload_gzip() -> bytes:
+    return gzip.compress(_cached_payload_bytes(), compresslevel=6)
+
+
+@lru_cache(maxsize=1)
+def _payload_etag() -> str:
+    # Content hash of the cached payload (computed once); gzip variant gets its own tag
+    return hashlib.blake2b(_cached_payload_bytes(), digest_size=16).hexdigest()
 
 
 @app.get("/heatmap")
-def get_edges_risks(nocache: bool = False):
+async def get_edges_risks(request: Request, nocache: bool = False):
     if nocache:
-        df = pd.read_parquet(EDGES_PATH)
-        payload = _build_payload()
-    else:
-        payload = _cached_payload()
+        return Response(content=orjson.dumps(_build_payload()), media_type="application/json")
 
-    return payload
+    gz = "gzip" in request.headers.get("accept-encoding", "")
+    etag = f'"{_payload_etag()}{"-gz" if gz else ""}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+
+    # Unchanged data: no body at all
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if gz:
+        return Response(content=_cached_payload_gzip(), media_type="application/json",
+                        headers=headers | {"Content-Encoding": "gzip"})
+    return Response(content=_cached_payload_bytes(), media_type="application/json", headers=headers)
 
 
 @app.get("/")
@@ -71,47 +136,86 @@ def index():
     return "hi"
 
 
-@app.post("/route")
-async def route_handler(request: Request):
-    data = await request.json()
+# Route results by start/end rounded to 4 decimals (~11 m): LRU bounded, entries expire after ROUTE_CACHE_TTL_S.
+ROUTE_CACHE_SIZE = 4096
+ROUTE_CACHE_TTL_S = 600.0
+_route_cache: "OrderedDict[tuple, tuple[float, object]]" = OrderedDict()
+# Searches in progress, so concurrent misses on the same key share one A* run (single-flight)
+_route_inflight: Dict[tuple, asyncio.Task] = {}
+
 
-    if not data or "from" not in data or "to" not in data:
-        return JSONResponse(
-            {"error": "Expected JSON body with fields 'from' and 'to'"},
-            status_code=400
-        )
-    start_lat = data["from"][0]
-    start_lon = data["from"][1]
+def _route_key(start_lat, start_lon, end_lat, end_lon) -> tuple:
+    return (round(start_lat, 4), round(start_lon, 4), round(end_lat, 4), round(end_lon, 4))
 
-    # CRITICAL FIX: Use data["to"] for the end coordinates
-    end_lat = data["to"][0]
-    end_lon = data["to"][1]
 
-    NODES_PATH = "../ml/data/data_backend/nodes_table.parquet"
-    EDGES_PATH = "../ml/data/data_backend/edges_table.parquet"
+def _route_cache_get(key):
+    hit = _route_cache.get(key)
+    if hit is None:
+        return None
+    expires, path = hit
+    if expires < time.monotonic():
+        del _route_cache[key]
+        return None
+    _route_cache.move_to_end(key)
+    return hit
 
-    edges_df = pd.read_parquet(EDGES_PATH)
-    nodes_df = pd.read_parquet(NODES_PATH)
 
-    result = a_star_v2.safest_route_between_coords(
+def _route_cache_put(key, path):
+    _route_cache[key] = (time.monotonic() + ROUTE_CACHE_TTL_S, path)
+    _route_cache.move_to_end(key)
+    while len(_route_cache) > ROUTE_CACHE_SIZE:
+        _route_cache.popitem(last=False)
+
+
+async def _route_search(key, start_lat, start_lon, end_lat, end_lon):
+    # A* is CPU-bound: run it in a worker thread so the event loop keeps serving other requests
+    path = await asyncio.to_thread(
+        a_star_v2.safest_route_between_coords,
         nodes_df, edges_df,
         start_lat, start_lon,
         end_lat, end_lon,
         undirected=True,  # set False if edges are directed
         attach_even_if_far_m=25.0,  # tweak if your edges/nodes are a bit misaligned
     )
+    _route_cache_put(key, path)
+    return path
+
+
+@app.post("/route", response_model=RouteOut)
+async def route_handler(payload: RouteIn):
+    # Shape/length checks are done by RouteIn (422 with a structured error on bad input)
+    start_lat, start_lon = payload.from_
+    end_lat, end_lon = payload.to
+
+    if nodes_df.empty or edges_df.empty:
+        raise HTTPException(status_code=503, detail="Routing data is not loaded")
+
+    key = _route_key(start_lat, start_lon, end_lat, end_lon)
+    hit = _route_cache_get(key)
+    if hit is not None:
+        return {"path": hit[1]}
+
+    task = _route_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_route_search(key, start_lat, start_lon, end_lat, end_lon))
+        _route_inflight[key] = task
+        task.add_done_callback(lambda _: _route_inflight.pop(key, None))
+    # shield: one client disconnecting must not cancel the search the others are waiting on
+    result = await asyncio.shield(task)
     return ({"path": result})
 
 
 "-----------------"
 "Gemini client"
 
-engine = init_db()
+engine = init_async_db()
+CHAT_CONTEXT_MESSAGES = 32  # Gemini context window (rows); the table itself is capped by add_message's limit
+SessionLocal = get_async_sessionmaker(engine)
 
 
 # Dependency to get DB session
-def db_dep():
-    with get_session(engine) as session:
+async def db_dep():
+    async with SessionLocal() as session:
         yield session
 
 
@@ -132,17 +236,17 @@ class MessageOut(BaseModel):
 
 
 @app.get("/api/chat", response_model=List[MessageOut])
-def list_messages(db: Session = Depends(db_dep)):
+async def list_messages(db: AsyncSession = Depends(db_dep)):
     """Fetches all messages from the database."""
-    rows = get_all_messages(db)
-    return [MessageOut.model_validate(r) for r in rows]
+    # ORM rows go straight to the response model (from_attributes); validated and encoded in one pass
+    return await get_all_messages_async(db)
 
 
 @app.post("/api/chat")
-def chat(payload: MessageIn, db: Session = Depends(db_dep)):
+async def chat(payload: MessageIn, db: AsyncSession = Depends(db_dep)):
     """
-    Receives a user message, stores it, asks Gemini for a response
-    using the entire chat history, stores the response, and returns 204.
+    Receives a user message, stores it, asks Gemini for a response using the recent chat history,
+    streams the reply as plain text, and stores it before the stream ends.
     """
     now = datetime.now(ZoneInfo("America/New_York"))
     user_text = payload.message.strip()
@@ -150,39 +254,54 @@ def chat(payload: MessageIn, db: Session = Depends(db_dep)):
     if not user_text:
         raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-    # 1. Retrieve the ENTIRE history, filtering out any None values.
-    chat_history_for_gemini = [
-        msg for msg in get_all_messages(db) if msg is not None
-    ]
-
-    # 2. Add the NEW user message to the database
-    new_user_msg = add_message(db, sender=0, text=user_text, timestamp=now)
-
-    if not new_user_msg:
-        raise HTTPException(status_code=500, detail="Failed to record user message.")
+    # 1. Retrieve the recent history (last CHAT_CONTEXT_MESSAGES rows; NULL messages filtered in SQL).
+    chat_history_for_gemini = await get_recent_messages_async(db, limit=CHAT_CONTEXT_MESSAGES)
 
+    # 2. Add the NEW user message to the database before streaming, so it survives a failed
+    #    or interrupted reply and is in the history the client refetches afterwards
+    new_user_msg = await add_message_async(db, sender=0, text=user_text, timestamp=now)
     chat_history_for_gemini.append(new_user_msg)
 
-    # 3. Get Gemini's response using the full history
-    assistant_text: str = ""
+    # 3. Stream Gemini's response using the recent history. The first chunk is pulled here so
+    #    configuration/API errors still turn into a 500 before any body is sent.
+    stream = astream_gemini_response(chat_history_for_gemini)
     try:
-        assistant_text = get_gemini_response(chat_history_for_gemini)
+        first_chunk = await anext(stream, "")
     except Exception as e:
         import traceback
         print(f"--- Chat processing error ---")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"AI model service failed: {e}")
 
-    # 4. Record Gemini's answer
-    assistant_now = datetime.now(ZoneInfo("America/New_York"))
-    add_message(db, sender=1, text=assistant_text, timestamp=assistant_now)
-
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
-
-# if __name__ == "__main__":
-#     import uvicorn
-#     uvicorn.run(
-#         app,
-#         host="0.0.0.0",
-#         port=8000
-#     )
\ No newline at end of file
+    async def relay():
+        parts = [first_chunk]
+        yield first_chunk
+        async for chunk in stream:
+            parts.append(chunk)
+            yield chunk
+
+        # 4. Record Gemini's answer before the generator returns: the body only ends after this,
+        #    so a client that refetches the history on end-of-stream always sees the reply.
+        #    Uses its own session: the request-scoped one may already be closed while the body streams.
+        assistant_text = "".join(parts).strip() or "Sorry—got an empty reply."
+        assistant_now = datetime.now(ZoneInfo("America/New_York"))
+        async with SessionLocal() as session:
+            await add_message_async(session, sender=1, text=assistant_text, timestamp=assistant_now)
+
+    return StreamingResponse(relay(), media_type="text/plain; charset=utf-8")
+
+if __name__ == "__main__":
+    import importlib.util
+    import uvicorn
+    # Same as: uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools --workers N
+    # uvloop/httptools (uvicorn[standard], see requirements.txt) are used when installed; otherwise uvicorn's
+    # stock asyncio loop and h11 parser. One worker unless WEB_CONCURRENCY says otherwise: each worker
+    # loads its own copy of the tables and route cache. The app must be an import string for workers > 1.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "auto",
+        http="httptools" if importlib.util.find_spec("httptools") else "auto",
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+    )